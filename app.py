@@ -1,22 +1,102 @@
 # app.py
+import hashlib
+import hmac
 import os
 import json
+import threading
 from datetime import datetime
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, request, abort, send_file
+import numpy as np
 import psutil
 import subprocess
+import urllib.error
+import urllib.request
+
+import dashboard_snapshot
+import session_archive
+import session_cache
+import session_format
+import session_ingest
+from sleep_analysis import INTENSITY_DTYPE
 
 app = Flask(__name__)
 
 # Path to the location of your JSON files
 JSON_FOLDER_PATH = os.path.expanduser('/home/luna/Documents/sleep_logs')
 
+# Sessions uploaded by other monitors go to their own directories (see session_ingest);
+# this monitor's own logs are the "local" device
+LOCAL_DEVICE = 'local'
+# Shared secret sent as "Authorization: Bearer <token>" by the monitors' uploads and by anything
+# controlling this monitor from another machine; both are refused without one
+INGEST_TOKEN = os.environ.get('SLEEP_INGEST_TOKEN')
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1', '::ffff:127.0.0.1')
+# Set SLEEP_DASHBOARD_HOST=0.0.0.0 on the hub so the other monitors can reach it
+DASHBOARD_HOST = os.environ.get('SLEEP_DASHBOARD_HOST', '127.0.0.1')
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+# Column-wise summaries of every night per log directory, kept up to date as logs arrive
+session_caches = {}
+session_caches_lock = threading.Lock()
+
+# Started by the first upload
+ingest_writer = None
+ingest_writer_lock = threading.Lock()
+
+# Snapshot manifests by log directory, as (manifest mtime, manifest)
+snapshot_manifests = {}
+snapshot_lock = threading.Lock()
+# Fingerprints of the session logs by log directory, as (directory mtime, fingerprint)
+source_stamps = {}
+
+class Coalescer:
+    """Lets concurrent callers asking for the same key share one computation.
+
+    The first caller computes; callers arriving while it runs wait for its result
+    instead of repeating the work. Nothing is kept once the computation finishes, so
+    a later call always sees fresh data.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}  # key -> {"done": Event, "result" or "error"}
+
+    def run(self, key, compute):
+        with self.lock:
+            call = self.running.get(key)
+            leader = call is None
+            if leader:
+                call = self.running[key] = {"done": threading.Event()}
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = compute()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.running[key]
+            call["done"].set()
+        return call["result"]
+
+# Several people opening the dashboard at once ask for the same sessions
+session_requests = Coalescer()
+# ... and find the same stale snapshot
+snapshot_rebuilds = Coalescer()
+
+# Local control endpoint of a running pop2.py (see LocalControlServer)
+MONITOR_CONTROL_URL = 'http://127.0.0.1:5001'
+
 def get_datetime_from_filename(filename):
     """Extract and parse datetime from the filename."""
     parts = filename.split('_')
     if len(parts) >= 4:
         date_str = parts[2]  # The date part (20241102)
-        time_str = parts[3].split('.')[0]  # The time part (143305), remove .json
+        time_str = parts[3].split('.')[0]  # The time part (143305), remove .json/.slog
         datetime_str = date_str + time_str
         return datetime.strptime(datetime_str, "%Y%m%d%H%M%S")
     return None
@@ -27,41 +107,100 @@ def format_datetime_display(dt):
         return dt.strftime("%Y-%m-%d %H:%M")
     return None
 
-def load_sorted_json_files(reverse_chronological=True):
+def device_directory(device=None):
+    """Log directory of `device`, or of this monitor when none is given; aborts if there is no such device."""
+    if not device or device == LOCAL_DEVICE:
+        return JSON_FOLDER_PATH
+    try:
+        directory = session_ingest.device_directory(JSON_FOLDER_PATH, device)
+    except ValueError:
+        abort(400)
+    if not os.path.isdir(directory):
+        abort(404)
+    return directory
+
+def requested_directory():
+    """Log directory selected by the request's optional `device` argument."""
+    return device_directory(request.args.get('device'))
+
+def sessions_for(log_directory):
+    with session_caches_lock:
+        if log_directory not in session_caches:
+            session_caches[log_directory] = session_cache.SessionCache(log_directory)
+        return session_caches[log_directory]
+
+def get_ingest_writer():
+    global ingest_writer
+    with ingest_writer_lock:
+        if ingest_writer is None:
+            ingest_writer = session_ingest.IngestWriter(JSON_FOLDER_PATH, on_commit=refresh_device_snapshot)
+            ingest_writer.start()
+        return ingest_writer
+
+def load_sorted_json_files(log_directory, reverse_chronological=True):
     """Load and sort sleep monitoring session files by datetime."""
-    files = [f for f in os.listdir(JSON_FOLDER_PATH) if f.startswith('sleep_log_') and f.endswith('.json')]
+    files = [f for f in os.listdir(log_directory) if session_format.is_session_log(f)]
     files.sort(key=get_datetime_from_filename, reverse=reverse_chronological)
     return files
 
-def process_sleep_data(data, filename):
-    """Process sleep monitoring data and format it for display."""
-    sleep_report = data.get('sleep_report', {})
+def load_sorted_sessions(log_directory, reverse_chronological=True):
+    """All sessions, hot files and archived ones, as (log file, archive summary or None) sorted by datetime."""
+    archived = session_archive.load_index(log_directory)
+    sessions = [(f, None) for f in load_sorted_json_files(log_directory) if f not in archived]
+    sessions.extend(archived.items())
+    sessions.sort(key=lambda session: get_datetime_from_filename(session[0]), reverse=reverse_chronological)
+    return sessions
+
+def process_sleep_data(summary, filename):
+    """Process a session summary (see session_archive.summarize_session) and format it for display."""
+    sleep_report = summary.get('sleep_report', {})
     session_datetime = get_datetime_from_filename(filename)
     
     return {
+        'log_file': filename,
         'session_datetime': format_datetime_display(session_datetime),
         'sleep_quality_score': sleep_report.get('sleep_score', 0),
-        'acoustic_disturbances': len(data.get('sound_peaks', [])),
-        'movement_activity': len(data.get('motion_events', [])),
+        'acoustic_disturbances': summary.get('sound_peak_count', 0),
+        'movement_activity': summary.get('motion_event_count', 0),
         'monitoring_duration': sleep_report.get('monitoring_duration', '0'),
         'motion_percentage': sleep_report.get('motion_percentage', '0%'),
-        'acoustic_frequency': sleep_report.get('sound_peaks_per_hour', 0)
+        'acoustic_frequency': sleep_report.get('sound_peaks_per_hour', 0),
+        'snoring_episodes': sleep_report.get('snoring_episodes'),
+        'snoring_duration': sleep_report.get('snoring_duration'),
+        'longest_snoring_episode': sleep_report.get('longest_snoring_episode'),
+        'restless_periods': sleep_report.get('restless_periods'),
+        'longest_restless_period': sleep_report.get('longest_restless_period')
     }
 
-def fetch_recent_sessions(n):
-    """Fetch the most recent n sleep monitoring sessions."""
-    # Get files in reverse chronological order for selecting most recent n files
-    files = load_sorted_json_files(reverse_chronological=True)
-    selected_files = files[:n]
+def fetch_recent_sessions(n, log_directory):
+    """Fetch the most recent n sleep monitoring sessions.
+
+    Concurrent calls for the same sessions share one read; the list returned is
+    shared between them and must not be modified.
+    """
+    return session_requests.run(('recent', n, log_directory), lambda: read_recent_sessions(n, log_directory))
+
+def read_recent_sessions(n, log_directory):
+    # Get sessions in reverse chronological order for selecting most recent n
+    sessions = load_sorted_sessions(log_directory, reverse_chronological=True)
+    selected_sessions = sessions[:n]
     sleep_data = []
     
-    # Process the selected files in chronological order (oldest to newest)
-    for file in reversed(selected_files):
-        file_path = os.path.join(JSON_FOLDER_PATH, file)
+    # Process the selected sessions in chronological order (oldest to newest)
+    for file, summary in reversed(selected_sessions):
+        if summary is not None:
+            # Archived nights are listed straight from the archive index
+            sleep_data.append(process_sleep_data(summary, file))
+            continue
+        file_path = os.path.join(log_directory, file)
         try:
+            if file.endswith('.slog'):
+                # Binary logs carry their summary in the header, so the events are never read
+                sleep_data.append(process_sleep_data(session_format.read_header(file_path), file))
+                continue
             with open(file_path, 'r') as f:
                 data = json.load(f)
-                sleep_data.append(process_sleep_data(data, file))
+                sleep_data.append(process_sleep_data(session_archive.summarize_session(data), file))
         except json.JSONDecodeError:
             print(f"Error decoding JSON from file: {file}")
         except Exception as e:
@@ -69,16 +208,152 @@ def fetch_recent_sessions(n):
     
     return sleep_data
 
+def load_motion_intensity(path):
+    """Map a motion intensity file without reading it; a partial trailing record is ignored."""
+    count = os.path.getsize(path) // INTENSITY_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=INTENSITY_DTYPE)
+    return np.memmap(path, dtype=INTENSITY_DTYPE, mode='r', shape=(count,))
+
+def downsample_intensity(records, points):
+    """Reduce records to at most `points` buckets of (start time, mean, max)."""
+    bucket = max(-(-len(records) // points), 1)
+    full = len(records) // bucket * bucket
+    timestamps = records["timestamp"][:full:bucket]
+    values = records["intensity"][:full].reshape(-1, bucket)
+    means = values.mean(axis=1)
+    maxima = values.max(axis=1)
+    if full < len(records):
+        tail = records["intensity"][full:]
+        timestamps = np.append(timestamps, records["timestamp"][full])
+        means = np.append(means, tail.mean())
+        maxima = np.append(maxima, tail.max())
+    return timestamps, means, maxima
+
+def render_dashboard(log_directory, device):
+    # For latest data, still get the most recent
+    latest_data = fetch_recent_sessions(1, log_directory)[-1] if fetch_recent_sessions(1, log_directory) else {}
+    return render_template('index.html', latest_data=latest_data, device=device)
+
+def source_stamp(log_directory):
+    """Fingerprint of the session logs in log_directory, which every snapshot records.
+
+    Logs are only ever written by renaming them into place, which changes the
+    directory's mtime, so the directory is only listed again after that changed.
+    """
+    mtime = os.stat(log_directory).st_mtime_ns
+    cached = source_stamps.get(log_directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(log_directory)):
+        if not session_format.is_session_log(filename):
+            continue
+        try:
+            stat = os.stat(os.path.join(log_directory, filename))
+        except FileNotFoundError:
+            continue
+        digest.update(f"{filename} {stat.st_mtime_ns} {stat.st_size}\n".encode())
+    stamp = digest.hexdigest()[:16]
+    source_stamps[log_directory] = (mtime, stamp)
+    return stamp
+
+def build_snapshot(log_directory, device=LOCAL_DEVICE):
+    """Render the dashboard's page and payloads for log_directory and write them as its snapshot."""
+    # Taken first: a log arriving while rendering leaves the snapshot stale, not wrongly current
+    source = source_stamp(log_directory)
+    query = '' if device == LOCAL_DEVICE else f'?device={device}'
+    with app.test_request_context('/' + query):
+        payloads = {
+            'index.html': render_dashboard(log_directory, device).encode(),
+            'recent-sessions.json': jsonify(fetch_recent_sessions(7, log_directory)).get_data(),
+            'extended-analysis.json': jsonify(fetch_recent_sessions(30, log_directory)).get_data()
+        }
+    with snapshot_lock:
+        return dashboard_snapshot.write_snapshot(dashboard_snapshot.snapshot_directory(log_directory), payloads,
+                                                 source)
+
+def refresh_device_snapshot(device_id, log_directory):
+    """Called by the ingest writer after it stored new sessions of a device."""
+    try:
+        build_snapshot(log_directory, device_id)
+    except Exception as e:
+        print(f"Error building snapshot for {device_id}: {e}")
+
+def send_snapshot(name, mimetype):
+    """The snapshot copy of a payload for the requested device, or None if there is none yet.
+
+    A snapshot older than the logs, for example after reprocess_night.py rewrote a
+    night, is rebuilt first.
+    """
+    log_directory = requested_directory()
+    directory = dashboard_snapshot.snapshot_directory(log_directory)
+    try:
+        mtime = os.path.getmtime(os.path.join(directory, dashboard_snapshot.MANIFEST_FILE))
+    except OSError:
+        return None
+    cached = snapshot_manifests.get(directory)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, dashboard_snapshot.load_manifest(directory))
+        snapshot_manifests[directory] = cached
+    manifest = cached[1]
+    if manifest.get("source") != source_stamp(log_directory):
+        device = request.args.get('device') or LOCAL_DEVICE
+        try:
+            manifest = snapshot_rebuilds.run(log_directory, lambda: build_snapshot(log_directory, device))
+        except Exception as e:
+            print(f"Error rebuilding stale snapshot for {device}: {e}")
+            return None
+    entry = manifest["files"].get(name)
+    if entry is None:
+        return None
+    try:
+        return send_file(os.path.join(directory, entry["file"]), mimetype=mimetype, etag=entry["sha256"],
+                         conditional=True, max_age=0)
+    except FileNotFoundError:
+        # Replaced by a newer snapshot in the meantime
+        return None
+
+def token_error(allow_loopback=False):
+    """The error response for a request without the shared token, or None if it may go ahead.
+
+    With allow_loopback, requests from this machine (pop2.py, the kiosk browser) need no token.
+    """
+    if allow_loopback and request.remote_addr in LOOPBACK_ADDRESSES:
+        return None
+    if not INGEST_TOKEN:
+        return jsonify({"status": "error", "message": "Disabled for other machines; set SLEEP_INGEST_TOKEN"}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {INGEST_TOKEN}'):
+        return jsonify({"status": "error", "message": "Missing or wrong token"}), 401
+    return None
+
 @app.route('/')
 def index():
     """Render the main dashboard with the latest sleep monitoring data."""
-    # For latest data, still get the most recent
-    latest_data = fetch_recent_sessions(1)[-1] if fetch_recent_sessions(1) else {}
-    return render_template('index.html', latest_data=latest_data)
+    snapshot = send_snapshot('index.html', 'text/html')
+    if snapshot is not None:
+        return snapshot
+    return render_dashboard(requested_directory(), request.args.get('device') or LOCAL_DEVICE)
+
+def post_monitor_control(path):
+    """Ask a running pop2.py to act on its session; returns None if it is not reachable."""
+    try:
+        req = urllib.request.Request(MONITOR_CONTROL_URL + path, data=b'', method='POST')
+        with urllib.request.urlopen(req, timeout=60) as response:
+            return json.load(response)
+    except (urllib.error.URLError, OSError):
+        return None
 
 @app.route('/kill-monitoring', methods=['POST'])
 def kill_monitoring():
-    """Kill the current pop2.py process."""
+    """Stop the current session, killing pop2.py only if it has no control endpoint."""
+    error = token_error(allow_loopback=True)
+    if error:
+        return error
+    # A running monitor keeps its camera warm, so end the session rather than the process
+    if post_monitor_control('/session/stop') is not None:
+        return jsonify({"status": "success", "message": "Monitoring session stopped"})
+
     killed = False
     try:
         for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
@@ -119,6 +394,12 @@ def kill_monitoring():
 @app.route('/start-monitoring', methods=['POST'])
 def start_monitoring():
     """Start a new monitoring session."""
+    error = token_error(allow_loopback=True)
+    if error:
+        return error
+    if post_monitor_control('/session/start') is not None:
+        return jsonify({"status": "success"})
+
     try:
         restart_script = '/home/luna/Documents/restart.sh'
         # Make sure the script is executable
@@ -141,15 +422,171 @@ def start_monitoring():
         print(f"Error starting monitoring: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Readiness probe polled by pop2.py before it points the browser at the dashboard."""
+    return jsonify({"status": "ok"})
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    """API endpoint for the monitors the query endpoints can be filtered by with `device`."""
+    return jsonify([LOCAL_DEVICE] + session_ingest.list_devices(JSON_FOLDER_PATH))
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest():
+    """API endpoint for batches of finished sessions uploaded by other monitors.
+
+    The body is gzip-compressed JSON as described in session_ingest; sessions that
+    were uploaded before with the same content are reported as "unchanged".
+    Requests must carry the SLEEP_INGEST_TOKEN shared secret.
+    """
+    error = token_error()
+    if error:
+        return error
+    try:
+        device_id, uploads = session_ingest.decode_batch(request.get_data(cache=False),
+                                                         request.headers.get('Content-Encoding'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if device_id == LOCAL_DEVICE:
+        return jsonify({"status": "error", "message": f"device_id {LOCAL_DEVICE!r} is reserved"}), 400
+    try:
+        results = get_ingest_writer().submit(device_id, uploads).wait(timeout=30)
+    except (OSError, TimeoutError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    return jsonify({"status": "success", "device_id": device_id, "sessions": results})
+
+@app.route('/api/snapshot', methods=['POST'])
+def refresh_snapshot():
+    """Rebuild the dashboard snapshot of the requested device; pop2.py calls this after each session."""
+    error = token_error(allow_loopback=True)
+    if error:
+        return error
+    device = request.args.get('device') or LOCAL_DEVICE
+    manifest = build_snapshot(requested_directory(), device)
+    return jsonify({"status": "success", "device": device, "files": manifest["files"]})
+
 @app.route('/api/recent-sessions', methods=['GET'])
 def get_recent_sessions():
     """API endpoint for recent sleep monitoring sessions (last 7)."""
-    return jsonify(fetch_recent_sessions(7))
+    snapshot = send_snapshot('recent-sessions.json', 'application/json')
+    if snapshot is not None:
+        return snapshot
+    return jsonify(fetch_recent_sessions(7, requested_directory()))
 
 @app.route('/api/extended-analysis', methods=['GET'])
 def get_extended_analysis():
     """API endpoint for extended sleep analysis (last 30 sessions)."""
-    return jsonify(fetch_recent_sessions(30))
+    snapshot = send_snapshot('extended-analysis.json', 'application/json')
+    if snapshot is not None:
+        return snapshot
+    return jsonify(fetch_recent_sessions(30, requested_directory()))
+
+@app.route('/api/trends', methods=['GET'])
+def get_trends():
+    """API endpoint for sleep statistics grouped by `group` (week, month or weekday).
+
+    Optional `days` limits the statistics to the nights of the last that many days.
+    """
+    group = request.args.get('group', default='week')
+    if group not in ('week', 'month', 'weekday'):
+        return jsonify({"status": "error", "message": "group must be week, month or weekday"}), 400
+    _, columns = sessions_for(requested_directory()).refresh()
+    days = request.args.get('days', type=int)
+    since = np.datetime64(datetime.now(), 's') - np.timedelta64(days, 'D') if days else None
+    return jsonify({"group": group, "trends": session_cache.grouped_trends(columns, group, since)})
+
+@app.route('/api/session-ranking/<log_file>', methods=['GET'])
+def get_session_ranking(log_file):
+    """API endpoint for how a night ranks against all others and the `k` most similar nights."""
+    log_file = os.path.basename(log_file)
+    sessions = sessions_for(requested_directory())
+    sessions.refresh()
+    # build_columns replaces both under the lock, so together they always match
+    with sessions.lock:
+        positions, columns = sessions.positions, sessions.columns
+    if log_file not in positions:
+        abort(404)
+
+    def score_of(other):
+        # A night similar() finds may be newer than this snapshot
+        if other not in positions:
+            return None
+        score = columns["score"][positions[other]]
+        return None if np.isnan(score) else float(score)
+
+    score = score_of(log_file)
+    similar = sessions.similar(log_file, k=min(max(request.args.get('k', default=5, type=int), 1), 50))
+    if similar is None:
+        abort(404)  # Removed since the snapshot
+    return jsonify({
+        "log_file": log_file,
+        "sleep_score": score,
+        "top_percent": None if score is None else round(sessions.top_percent(score), 1),
+        "nights": len(positions),
+        "similar": [
+            {
+                "log_file": other,
+                "session_datetime": format_datetime_display(get_datetime_from_filename(other)),
+                "sleep_score": score_of(other),
+                "distance": round(distance, 3)
+            }
+            for other, distance in similar
+        ]
+    })
+
+@app.route('/api/motion-intensity/<log_file>', methods=['GET'])
+def get_motion_intensity(log_file):
+    """API endpoint for a session's motion intensity, downsampled for charting.
+
+    Optional `start`/`end` (epoch seconds) select a window of the night and `points`
+    caps the number of buckets returned.
+    """
+    log_file = os.path.basename(log_file)
+    log_directory = requested_directory()
+    log_path = os.path.join(log_directory, log_file)
+    if os.path.exists(log_path):
+        if log_file.endswith('.slog'):
+            intensity_file = session_format.read_header(log_path).get('motion_intensity_file')
+        else:
+            with open(log_path, 'r') as f:
+                intensity_file = json.load(f).get('motion_intensity_file')
+        # Uploaded sessions come without their intensity series
+        intensity_path = os.path.join(log_directory, os.path.basename(intensity_file or ''))
+        if not intensity_file or not os.path.exists(intensity_path):
+            return jsonify({"timestamps": [], "intensity_mean": [], "intensity_max": []})
+        records = load_motion_intensity(intensity_path)
+    else:
+        archive = session_archive.find_archive(log_directory, log_file)
+        if archive is None:
+            abort(404)
+        records = archive.load_intensity(log_file)
+
+    # Timestamps are appended in order, so a window is two binary searches away
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    first = np.searchsorted(records["timestamp"], start) if start is not None else 0
+    last = np.searchsorted(records["timestamp"], end, side='right') if end is not None else len(records)
+    records = records[first:last]
+    if len(records) == 0:
+        return jsonify({"timestamps": [], "intensity_mean": [], "intensity_max": []})
+
+    points = min(max(request.args.get('points', default=600, type=int), 1), 5000)
+    timestamps, means, maxima = downsample_intensity(records, points)
+    return jsonify({
+        "timestamps": timestamps.tolist(),
+        "intensity_mean": means.astype(float).tolist(),
+        "intensity_max": maxima.astype(float).tolist()
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Sessions may have ended while the dashboard was not running
+    try:
+        build_snapshot(JSON_FOLDER_PATH)
+    except Exception as e:
+        print(f"Error building snapshot: {e}")
+    # The debugger runs code for whoever can reach it, so it is only on while serving loopback
+    debug = DASHBOARD_HOST in ('127.0.0.1', 'localhost', '::1')
+    # Under pop2.py's supervision the reloader's extra process would outlive a restart
+    app.run(host=DASHBOARD_HOST, debug=debug,
+            use_reloader=debug and os.environ.get('SLEEP_DASHBOARD_SUPERVISED') != '1')
\ No newline at end of file
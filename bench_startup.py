@@ -0,0 +1,71 @@
+# bench_startup.py
+"""Measure the cold-start import time of each entry point with `python -X importtime`.
+
+Every module is imported in a fresh interpreter several times; the median of its
+cumulative import time is reported together with the slowest imports it pulls in.
+With --history the results are appended as one JSON line per run, so start-up time
+can be tracked across changes.
+
+Usage:
+    python3 bench_startup.py --runs 7 --history startup_history.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+ENTRY_POINTS = ['sleep_analysis', 'pop2', 'app', 'reprocess_night', 'benchmark_detectors', 'sleep_monitor_system']
+
+def import_times(module):
+    """Import module in a new interpreter; returns {imported module: cumulative microseconds}."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def measure(module, runs):
+    samples = [import_times(module) for _ in range(runs)]
+    total = statistics.median(sample[module] for sample in samples)
+    # Slowest direct and indirect dependencies, judged on the last run
+    dependencies = sorted(((us, name) for name, us in samples[-1].items() if name != module), reverse=True)
+    return total, dependencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start import time of the sleep monitor entry points.")
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=3, help="Slowest imports listed per entry point")
+    parser.add_argument('--history', default=None, help="JSON lines file to append the results to")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'entry point':<22} {'median ms':>10}  slowest imports")
+    for module in args.modules:
+        try:
+            total, dependencies = measure(module, args.runs)
+        except RuntimeError as e:
+            print(f"{module:<22} {'failed':>10}  {e}")
+            results[module] = None
+            continue
+        results[module] = round(total / 1000, 1)
+        slowest = ", ".join(f"{name} {us / 1000:.0f}" for us, name in dependencies[:args.top])
+        print(f"{module:<22} {total / 1000:>10.1f}  {slowest}")
+
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps({"time": datetime.now().isoformat(), "python": sys.version.split()[0],
+                                "runs": args.runs, "import_ms": results}) + "\n")
+
+if __name__ == '__main__':
+    main()
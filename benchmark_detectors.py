@@ -0,0 +1,87 @@
+# benchmark_detectors.py
+"""Compare the motion-detector engines of pop2.py over recorded frame sequences.
+
+Each input is either a video file readable by cv2.VideoCapture or a directory of
+frame images (.png/.jpg/.npy, processed in filename order). Frames are decoded up
+front so that only detection work is timed.
+
+Usage:
+    python3 benchmark_detectors.py night1.mp4 frames_dir/ --max-frames 3000
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from pop2 import MOTION_DETECTORS, ContourMotionDetector, create_motion_detector, open_frame_source
+
+def load_frames(path, max_frames=None):
+    """Load up to max_frames BGR frames from a video file or a frame directory."""
+    # Only relative timing matters here, so any start time will do
+    source = open_frame_source(path, start_time=datetime.now())
+    frames = []
+    try:
+        while max_frames is None or len(frames) < max_frames:
+            frame = source.read()
+            if frame is None:
+                break
+            frames.append(frame.image)
+    finally:
+        source.close()
+    return frames
+
+def run_engine(name, sequences):
+    """Run one engine over every sequence, returning its decisions and timings."""
+    decisions = []
+    wall_time = 0.0
+    cpu_time = 0.0
+    for frames in sequences:
+        detector = create_motion_detector(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for frame in frames:
+            decisions.append(detector.detect(frame))
+        wall_time += time.perf_counter() - wall_start
+        cpu_time += time.process_time() - cpu_start
+    return np.array(decisions, dtype=bool), wall_time, cpu_time
+
+def agreement(decisions, baseline):
+    """Frame agreement plus recall/precision of motion frames against the baseline."""
+    matches = np.count_nonzero(decisions == baseline) / len(baseline) if len(baseline) else 1.0
+    true_positives = np.count_nonzero(decisions & baseline)
+    recall = true_positives / np.count_nonzero(baseline) if baseline.any() else 1.0
+    precision = true_positives / np.count_nonzero(decisions) if decisions.any() else 1.0
+    return matches, recall, precision
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark motion-detector engines on recorded frames.")
+    parser.add_argument('inputs', nargs='+', help="Video files or directories of frame images")
+    parser.add_argument('--max-frames', type=int, default=None, help="Frames to load per input")
+    parser.add_argument('--engines', nargs='+', default=list(MOTION_DETECTORS), choices=list(MOTION_DETECTORS))
+    args = parser.parse_args()
+
+    sequences = [load_frames(path, args.max_frames) for path in args.inputs]
+    total_frames = sum(len(frames) for frames in sequences)
+    if total_frames == 0:
+        parser.error("no frames could be loaded from the given inputs")
+    print(f"Loaded {total_frames} frames from {len(sequences)} input(s)")
+
+    engines = list(args.engines)
+    baseline_name = ContourMotionDetector.name
+    if baseline_name not in engines:
+        engines.insert(0, baseline_name)
+
+    results = {name: run_engine(name, sequences) for name in engines}
+    baseline = results[baseline_name][0]
+
+    print(f"{'engine':<12} {'fps':>9} {'cpu ms/frame':>13} {'motion %':>9} {'agree %':>8} {'recall %':>9} {'precision %':>12}")
+    for name in engines:
+        decisions, wall_time, cpu_time = results[name]
+        matches, recall, precision = agreement(decisions, baseline)
+        fps = total_frames / wall_time if wall_time > 0 else float('inf')
+        print(f"{name:<12} {fps:>9.1f} {cpu_time / total_frames * 1000:>13.3f} "
+              f"{decisions.mean() * 100:>9.2f} {matches * 100:>8.2f} {recall * 100:>9.2f} {precision * 100:>12.2f}")
+
+if __name__ == '__main__':
+    main()
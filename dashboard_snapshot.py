@@ -0,0 +1,87 @@
+# dashboard_snapshot.py
+"""Precomputed copies of the dashboard's pages and payloads, rebuilt when a session ends.
+
+The data behind `/`, `/api/recent-sessions` and `/api/extended-analysis` only changes
+when a night is finalized or uploaded, so app.py renders them once at that point and
+writes them to `snapshot/` in the log directory. Every file is named after a hash of
+its content and written atomically; `manifest.json`, replaced last, maps each
+payload to its current file. Requests are then answered straight from disk, and the
+hash doubles as the ETag.
+
+The manifest also records a fingerprint of the session logs it was built from, so
+app.py notices logs written behind its back (reprocess_night.py, a copied backup)
+and rebuilds the snapshot before serving it.
+
+Files of the previous snapshot are kept until the next one replaces it, so a reader
+that just read the old manifest still finds its file.
+
+Usage:
+    python3 dashboard_snapshot.py --log-directory /home/luna/Documents/sleep_logs
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from sleep_analysis import sync_directory_entries, write_file_atomically, write_json_atomically
+
+SNAPSHOT_DIRECTORY = "snapshot"
+MANIFEST_FILE = "manifest.json"
+
+def snapshot_directory(log_directory):
+    return os.path.join(log_directory, SNAPSHOT_DIRECTORY)
+
+def hashed_name(name, digest):
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{digest[:16]}{extension}"
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_snapshot(directory, payloads, source=None):
+    """Write {name: bytes} payloads as content-hashed files plus a manifest; returns the manifest.
+
+    `source` identifies the logs the payloads were rendered from.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = load_manifest(directory) or {"files": {}}
+    files = {}
+    for name, content in payloads.items():
+        digest = hashlib.sha256(content).hexdigest()
+        filename = hashed_name(name, digest)
+        path = os.path.join(directory, filename)
+        # An unchanged payload keeps its file, and its ETag
+        if not os.path.exists(path):
+            write_file_atomically(path, content, sync_directory=False)
+        files[name] = {"file": filename, "sha256": digest, "bytes": len(content)}
+    # Only a manifest whose files are all durable may replace the old one
+    sync_directory_entries(directory)
+    manifest = {"generated": datetime.now().isoformat(), "source": source, "files": files}
+    write_json_atomically(os.path.join(directory, MANIFEST_FILE), manifest)
+
+    keep = {MANIFEST_FILE} | {entry["file"] for entry in files.values()}
+    keep |= {entry["file"] for entry in previous["files"].values()}
+    for filename in os.listdir(directory):
+        if filename not in keep and not filename.startswith("."):
+            os.remove(os.path.join(directory, filename))
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the dashboard snapshot of a log directory.")
+    parser.add_argument('--log-directory', default="/home/luna/Documents/sleep_logs")
+    args = parser.parse_args()
+
+    # The payloads are rendered by the dashboard itself, so they match what it would serve
+    import app
+    app.JSON_FOLDER_PATH = args.log_directory
+    manifest = app.build_snapshot(args.log_directory)
+    for name, entry in sorted(manifest["files"].items()):
+        print(f"{name:<24} {entry['file']:<44} {entry['bytes']:>8} bytes")
+
+if __name__ == '__main__':
+    main()
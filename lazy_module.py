@@ -0,0 +1,16 @@
+import importlib
+
+class LazyModule:
+    """A module that is only imported when one of its attributes is first used.
+
+    The hardware and vision libraries take a long time to import on the Pi and are
+    missing on other machines, so they are loaded when a monitor actually needs them.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self.__name), attr)
+        setattr(self, attr, value)  # Later lookups are plain attribute reads
+        return value
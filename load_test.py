@@ -0,0 +1,267 @@
+# load_test.py
+"""Local load generator for a running app.py.
+
+The ingest scenario has several client threads play a fleet of monitors: each
+device uploads synthetic nights to /api/ingest in gzip-compressed batches. Every
+batch is then sent a second time, which must change nothing, and each device's
+sessions are read back through the device filter of /api/recent-sessions.
+
+The dashboard scenario plays family members opening the dashboard at the same time:
+each client repeatedly requests a weighted random pick of `/`, /api/recent-sessions
+and /api/extended-analysis for a fixed time. Throughput and latency percentiles are
+reported per path and checked against SLO targets; the exit status is 1 if any
+target is missed.
+
+The ingest scenario needs the dashboard's upload token, from --token or
+SLEEP_INGEST_TOKEN.
+
+Usage:
+    python3 load_test.py --url http://127.0.0.1:5000 --clients 8 --devices 4 --nights 60
+    python3 load_test.py --scenario dashboard --clients 16 --duration 30 --slo p95=250 --slo p99=1000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import session_ingest
+from sleep_analysis import SleepQualityAnalyzer
+
+def synthetic_nights(device_id, nights, log_directory, seed=0):
+    """(log file, log data) for `nights` consecutive made-up nights of one device."""
+    rng = random.Random(f"{device_id}-{seed}")
+    sessions = []
+    # The analyzer reports every event; only the logs it writes are of interest here
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer = SleepQualityAnalyzer(log_directory)
+        for night in range(nights):
+            start = datetime(2024, 1, 1, 22) + timedelta(days=night, minutes=rng.uniform(0, 120))
+            end = start + timedelta(hours=rng.uniform(6, 9))
+            span = (end - start).total_seconds()
+            analyzer.start_monitoring(start_time=start)
+            for offset in sorted(rng.uniform(0, span - 60) for _ in range(rng.randint(0, 40))):
+                event_start = start + timedelta(seconds=offset)
+                analyzer.log_motion_event(event_start, event_start + timedelta(seconds=rng.uniform(1, 60)))
+            for offset in sorted(rng.uniform(0, span) for _ in range(rng.randint(0, 300))):
+                analyzer.log_sound_peak(start + timedelta(seconds=offset))
+            analyzer.stop_monitoring(end_time=end)
+            filepath, _ = analyzer.finalize_session()
+            with open(filepath, 'r') as f:
+                sessions.append((os.path.basename(filepath), json.load(f)))
+            os.remove(filepath)
+    return sessions
+
+def post(url, body, token, timeout=60):
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        "Content-Type": "application/json", "Content-Encoding": "gzip", "Authorization": f"Bearer {token}"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+def run_clients(url, batches, clients, token):
+    """POST every (device id, body) batch using `clients` threads; returns (seconds, latencies, results, errors)."""
+    work = queue.Queue()
+    for batch in batches:
+        work.put(batch)
+    latencies = []
+    results = {}
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            try:
+                device_id, body = work.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                response = post(url + '/api/ingest', body, token)
+            except (urllib.error.URLError, OSError) as e:
+                with lock:
+                    errors.append(f"{device_id}: {e}")
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                for status in response["sessions"].values():
+                    results[status] = results.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies), results, errors
+
+def print_round(name, sessions, seconds, latencies, results, errors):
+    ms = [latency * 1000 for latency in latencies]
+    print(f"{name}: {len(latencies)} batches, {sessions} sessions in {seconds:.2f} s "
+          f"({sessions / seconds:.0f} sessions/s)")
+    print(f"  latency ms  p50 {percentile(ms, 0.5):.1f}  p95 {percentile(ms, 0.95):.1f}  "
+          f"p99 {percentile(ms, 0.99):.1f}  max {ms[-1] if ms else float('nan'):.1f}")
+    print(f"  results {results}" + (f", {len(errors)} failed batches, first: {errors[0]}" if errors else ""))
+
+# A page view fetches both charts' data after the page itself
+DASHBOARD_MIX = {'/': 1, '/api/recent-sessions': 1, '/api/extended-analysis': 1}
+DEFAULT_SLOS = {'p50': 100, 'p95': 250, 'p99': 1000}
+
+def parse_weight(text):
+    path, _, weight = text.rpartition('=')
+    if not path.startswith('/'):
+        raise argparse.ArgumentTypeError(f"expected PATH=WEIGHT, got {text!r}")
+    return path, float(weight)
+
+def parse_slo(text):
+    name, _, milliseconds = text.partition('=')
+    if not name.startswith('p') or not name[1:].replace('.', '', 1).isdigit() or not milliseconds:
+        raise argparse.ArgumentTypeError(f"expected pNN=MILLISECONDS, got {text!r}")
+    return name, float(milliseconds)
+
+def replay_dashboard(url, mix, clients, duration, device=None, seed=0):
+    """Request weighted random paths from `clients` threads for `duration` seconds.
+
+    Returns (seconds, {path: sorted latencies}, {path: error count}, first error).
+    """
+    paths = list(mix)
+    weights = [mix[path] for path in paths]
+    query = f"?device={device}" if device else ""
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    first_error = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(number):
+        rng = random.Random(f"{seed}-{number}")
+        while time.perf_counter() < deadline:
+            path = rng.choices(paths, weights)[0]
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url + path + query, timeout=60) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError) as e:
+                with lock:
+                    errors[path] += 1
+                    first_error[:] = first_error or [f"{path}: {e}"]
+                continue
+            with lock:
+                latencies[path].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter() - started, {path: sorted(values) for path, values in latencies.items()}, errors,
+            first_error[0] if first_error else None)
+
+def report_dashboard(seconds, latencies, errors, slos):
+    """Print per-path and overall statistics; returns True if every SLO is met."""
+    names = sorted(slos, key=lambda name: float(name[1:]))
+    print(f"{'path':<26} {'requests':>8} {'req/s':>7} {'errors':>6}  " + "  ".join(f"{name:>7}" for name in names)
+          + f"  {'max':>7}  (ms)")
+    everything = sorted(latency for values in latencies.values() for latency in values)
+    rows = list(latencies.items()) + [("all", everything)]
+    for path, values in rows:
+        ms = [latency * 1000 for latency in values]
+        failed = sum(errors.values()) if path == "all" else errors[path]
+        print(f"{path:<26} {len(ms):>8} {len(ms) / seconds:>7.1f} {failed:>6}  "
+              + "  ".join(f"{percentile(ms, float(name[1:]) / 100):>7.1f}" for name in names)
+              + f"  {ms[-1] if ms else float('nan'):>7.1f}")
+
+    met = True
+    ms = [latency * 1000 for latency in everything]
+    for name in names:
+        value = percentile(ms, float(name[1:]) / 100)
+        passed = value <= slos[name]
+        met = met and passed
+        print(f"SLO {name} <= {slos[name]:g} ms: {value:.1f} ms, {'met' if passed else 'MISSED'}")
+    if sum(errors.values()):
+        met = False
+        print(f"SLO no errors: {sum(errors.values())} failed requests, MISSED")
+    return met
+
+def run_dashboard(args):
+    mix = dict(args.path) if args.path else DASHBOARD_MIX
+    slos = dict(args.slo) if args.slo else DEFAULT_SLOS
+    print(f"{args.clients} clients for {args.duration:g} s against {args.url}")
+    seconds, latencies, errors, first_error = replay_dashboard(args.url, mix, args.clients, args.duration,
+                                                               args.device, args.seed)
+    met = report_dashboard(seconds, latencies, errors, slos)
+    if first_error:
+        print(f"First error: {first_error}")
+    return met
+
+def run_ingest(args):
+    batches = []
+    # The analyzer also leaves an intensity file per night behind
+    with tempfile.TemporaryDirectory(prefix="load_test_") as log_directory:
+        for device in range(args.devices):
+            device_id = f"load-test-{device}"
+            sessions = synthetic_nights(device_id, args.nights, log_directory, args.seed)
+            for i in range(0, len(sessions), args.batch_size):
+                batches.append((device_id, session_ingest.encode_batch(device_id, sessions[i:i + args.batch_size])))
+    random.Random(args.seed).shuffle(batches)
+    total = args.devices * args.nights
+    print(f"{len(batches)} batches, {sum(len(body) for _, body in batches) / 1024:.0f} KiB compressed")
+
+    upload = run_clients(args.url, batches, args.clients, args.token)
+    print_round("Upload", total, *upload)
+    # The same uploads again: nothing may be rewritten
+    seconds, latencies, results, errors = run_clients(args.url, batches, args.clients, args.token)
+    print_round("Resend", total, seconds, latencies, results, errors)
+    errors = upload[3] + errors
+    if set(results) - {"unchanged"}:
+        print("  Resending changed stored sessions; uploads are not idempotent!")
+
+    for device in range(args.devices):
+        device_id = f"load-test-{device}"
+        with urllib.request.urlopen(f"{args.url}/api/recent-sessions?device={device_id}", timeout=60) as response:
+            listed = len(json.load(response))
+        expected = min(7, args.nights)
+        print(f"{device_id}: {listed} recent sessions listed" + ("" if listed == expected else f", expected {expected}!"))
+    return not errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running dashboard (app.py).")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--scenario', choices=['ingest', 'dashboard'], default='ingest')
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent client threads")
+    parser.add_argument('--seed', type=int, default=0)
+    ingest = parser.add_argument_group("ingest scenario")
+    ingest.add_argument('--devices', type=int, default=4)
+    ingest.add_argument('--nights', type=int, default=60, help="Nights uploaded per device")
+    ingest.add_argument('--batch-size', type=int, default=10, help="Sessions per upload")
+    ingest.add_argument('--token', default=os.environ.get('SLEEP_INGEST_TOKEN', ''),
+                        help="The dashboard's upload token (default: $SLEEP_INGEST_TOKEN)")
+    dashboard = parser.add_argument_group("dashboard scenario")
+    dashboard.add_argument('--duration', type=float, default=30, help="Seconds to keep the clients busy")
+    dashboard.add_argument('--path', type=parse_weight, action='append',
+                           help="PATH=WEIGHT to request, repeatable (default: / and both chart APIs equally)")
+    dashboard.add_argument('--device', default=None, help="Device filter added to every request")
+    dashboard.add_argument('--slo', type=parse_slo, action='append',
+                           help="Latency target over all requests as pNN=MILLISECONDS, repeatable "
+                                "(default: p50=100 p95=250 p99=1000)")
+    args = parser.parse_args()
+
+    ok = run_dashboard(args) if args.scenario == 'dashboard' else run_ingest(args)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+# night_simulator.py
+"""Run pop2.py's full monitoring pipeline through a scripted night without any hardware.
+
+The camera is replaced by a fake Picamera2 serving synthetic (or recorded) frames,
+the sound sensor and button by gpiozero's mock pin factory and the LCD's I2C bus by
+an in-memory one. A virtual clock stands in for time.time(), and the simulation
+steps the monitors itself instead of letting their threads poll, so an eight-hour
+night takes seconds to minutes and the CPU cost of each component can be measured.
+
+Usage:
+    python3 night_simulator.py --hours 8 --seed 3
+    python3 night_simulator.py --recording night_20241102_223000.mp4 --hours 1
+"""
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime
+
+import numpy as np
+
+import pop2
+import sleep_analysis
+from pop2 import (CameraService, FrameRateGovernor, InfraredCameraMonitor, LCD1602, LCDButtonInterface,
+                  SoundMonitor, open_frame_source)
+from sleep_analysis import SleepQualityAnalyzer
+
+SOUND_SENSOR_PIN = 27
+CONTROL_BUTTON_PIN = 25
+
+class VirtualClock:
+    """Replacement for the time module whose wall clock only moves when the simulation says so.
+
+    sleep() advances the clock when called from the simulation thread and really
+    sleeps anywhere else; the performance counters stay real so profiling still works.
+    """
+
+    CLOCK_BOOTTIME = getattr(time, "CLOCK_BOOTTIME", 7)
+
+    def __init__(self, start):
+        self.now = start
+        self.owner = threading.current_thread()
+
+    def time(self):
+        return self.now
+
+    def clock_gettime_ns(self, clock):
+        return int(self.now * 1e9)
+
+    def sleep(self, seconds):
+        if threading.current_thread() is self.owner:
+            self.now += seconds
+        else:
+            time.sleep(seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def virtual_datetime(clock):
+    class VirtualDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(clock.now, tz)
+
+    return VirtualDatetime
+
+class NightScript:
+    """When the sleeper moves and snores, drawn from a seeded random generator."""
+
+    def __init__(self, start, hours=8, seed=0, motion_per_hour=3, snoring_per_hour=4):
+        rng = random.Random(seed)
+        length = hours * 3600
+        self.motion = self.episodes(rng, start, length, int(motion_per_hour * hours), 3, 30)
+        self.snoring = self.episodes(rng, start, length, int(snoring_per_hour * hours), 20, 180)
+        self.motion_starts = [episode[0] for episode in self.motion]
+        self.snoring_starts = [episode[0] for episode in self.snoring]
+
+    @staticmethod
+    def episodes(rng, start, length, count, shortest, longest):
+        return sorted((start + rng.uniform(0, length), rng.uniform(shortest, longest)) for _ in range(count))
+
+    @staticmethod
+    def active(episodes, starts, t):
+        index = bisect.bisect_right(starts, t) - 1
+        return index >= 0 and t < episodes[index][0] + episodes[index][1]
+
+    def moving(self, t):
+        return self.active(self.motion, self.motion_starts, t)
+
+    def sound_level(self, t):
+        """Sensor output: a 60 ms burst at the start of every 4 s breath while snoring."""
+        index = bisect.bisect_right(self.snoring_starts, t) - 1
+        if index < 0 or t >= self.snoring[index][0] + self.snoring[index][1]:
+            return False
+        return (t - self.snoring[index][0]) % 4.0 < 0.06
+
+class SyntheticScene:
+    """A dark, slightly noisy bedroom, with a bright limb sweeping across it while the sleeper moves."""
+
+    def __init__(self, script, resolution=(640, 480), seed=0, variants=8):
+        rng = np.random.default_rng(seed)
+        width, height = resolution
+        base = rng.integers(10, 40, (height, width, 3), dtype=np.uint8)
+        # A few noise variants are cycled so that consecutive frames are never identical
+        self.still = [base + rng.integers(0, 4, base.shape, dtype=np.uint8) for _ in range(variants)]
+        self.moving = []
+        for step in range(variants * 2):
+            frame = self.still[step % variants].copy()
+            x = width // 4 + step * width // (variants * 4)
+            frame[height // 3:height // 3 + 60, x:x + 120] = 200
+            self.moving.append(frame)
+        self.script = script
+
+    def frame(self, t, index):
+        frames = self.moving if self.script.moving(t) else self.still
+        return frames[index % len(frames)]
+
+class RecordedScene:
+    """Frames of a recording (see pop2.open_frame_source), looped for as long as the night lasts."""
+
+    def __init__(self, path, max_frames=3000):
+        source = open_frame_source(path, start_time=datetime.now())
+        self.frames = []
+        try:
+            while len(self.frames) < max_frames:
+                frame = source.read()
+                if frame is None:
+                    break
+                self.frames.append(frame.image)
+        finally:
+            source.close()
+        if not self.frames:
+            raise ValueError(f"No frames could be read from {path}")
+
+    def frame(self, t, index):
+        return self.frames[index % len(self.frames)]
+
+class FakeRequest:
+    def __init__(self, image, timestamp_ns):
+        self.image = image
+        self.timestamp_ns = timestamp_ns
+
+    def make_array(self, name):
+        return self.image
+
+    def get_metadata(self):
+        return {"SensorTimestamp": self.timestamp_ns}
+
+    def release(self):
+        pass
+
+class FakePicamera2:
+    """Enough of picamera2.Picamera2 for Picamera2Source, with frames taken from a scene."""
+
+    def __init__(self, scene, clock):
+        self.scene = scene
+        self.clock = clock
+        self.frame_interval = 1 / 30
+        self.frames_served = 0
+
+    def create_video_configuration(self, **kwargs):
+        return kwargs
+
+    def configure(self, config):
+        pass
+
+    def set_controls(self, controls):
+        if "FrameDurationLimits" in controls:
+            self.frame_interval = controls["FrameDurationLimits"][0] / 1e6
+
+    def start(self):
+        pass
+
+    def capture_request(self):
+        image = self.scene.frame(self.clock.now, self.frames_served)
+        self.frames_served += 1
+        return FakeRequest(image, self.clock.clock_gettime_ns(self.clock.CLOCK_BOOTTIME))
+
+    def close(self):
+        pass
+
+class MemorySMBus:
+    """I2C bus for the LCD1602 that keeps the display contents in memory and counts traffic."""
+
+    def __init__(self, columns=16):
+        self.columns = columns
+        self.rows = [[" "] * columns for _ in range(2)]
+        self.address = 0
+        self.transactions = 0
+        self.bytes_sent = 0
+
+    def write_byte_data(self, addr, register, value):
+        self.transactions += 1
+        self.bytes_sent += 2
+        if register == 0x80:
+            self.command(value)
+        else:
+            self.data([value])
+
+    def write_i2c_block_data(self, addr, register, data):
+        self.transactions += 1
+        self.bytes_sent += 1 + len(data)
+        self.data(data)
+
+    def command(self, value):
+        if value == 0x01:
+            self.rows = [[" "] * self.columns for _ in range(2)]
+            self.address = 0
+        elif value in (0x02, 0x03):
+            self.address = 0
+        elif value & 0x80:
+            self.address = value & 0x7f
+
+    def data(self, values):
+        for value in values:
+            row, col = divmod(self.address, 0x40)
+            if row < len(self.rows) and col < self.columns:
+                self.rows[row][col] = chr(value)
+            self.address += 1
+
+    def screen(self):
+        return ["".join(row) for row in self.rows]
+
+    def close(self):
+        pass
+
+class OfflineDashboard:
+    url = "http://127.0.0.1:5000"
+
+    def ensure_running(self):
+        return True
+
+    def refresh_snapshot(self):
+        return True
+
+    def stop(self):
+        pass
+
+class OfflineBrowser:
+    def show(self):
+        pass
+
+class SimulatedSoundMonitor(SoundMonitor):
+    """Opens the sensor on start() and is then polled by the simulation instead of its own thread."""
+
+    def start(self):
+        self.open_sensor()
+
+    def join(self, timeout=None):
+        self.finish()
+
+class SimulatedCameraMonitor(InfraredCameraMonitor):
+    """Handles the frames the simulation hands it instead of running capture and processing threads."""
+
+    def start(self):
+        self.begin()
+        self.handle_frame(self.source.read())
+
+    def join(self, timeout=None):
+        self.finish()
+
+class SimulatedInterface(LCDButtonInterface):
+    def create_monitors(self):
+        sound_monitor = SimulatedSoundMonitor(sound_sensor_pin=SOUND_SENSOR_PIN, analyzer=self.analyzer,
+                                              profiler=self.new_profiler())
+        camera_monitor = SimulatedCameraMonitor(analyzer=self.analyzer, roi=self.roi, source=self.camera_service,
+                                                profiler=self.new_profiler(), governor=self.governor)
+        return sound_monitor, camera_monitor
+
+class ComponentTimer:
+    """Simulation-thread CPU time and call counts per component of the pipeline.
+
+    Work that pop2 hands to its own threads (session start and stop) is timed with
+    the wall clock instead.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+
+    @contextlib.contextmanager
+    def measure(self, component, clock=time.thread_time):
+        started = clock()
+        yield
+        self.seconds[component] = self.seconds.get(component, 0.0) + clock() - started
+        self.calls[component] = self.calls.get(component, 0) + 1
+
+class NightSimulator:
+    def __init__(self, scene_factory, script, start, hours, log_directory, sound_poll_hz=100, profiling=False):
+        self.clock = VirtualClock(start)
+        self.script = script
+        self.end = start + hours * 3600
+        self.poll_interval = 1 / sound_poll_hz
+        self.timer = ComponentTimer()
+        self.cameras = []
+        self.install(scene_factory)
+
+        from gpiozero import Device
+        from gpiozero.pins.mock import MockFactory
+        Device.pin_factory = MockFactory()
+        self.pin_factory = Device.pin_factory
+        self.sound_pin = self.pin_factory.pin(SOUND_SENSOR_PIN)
+        self.button_pin = self.pin_factory.pin(CONTROL_BUTTON_PIN)
+
+        self.bus = MemorySMBus()
+        self.analyzer = SleepQualityAnalyzer(log_directory=log_directory)
+        self.camera_service = CameraService()
+        self.camera_service.open()
+        self.interface = SimulatedInterface(LCD1602(self.bus, lines=2, dotsize=0), pop2.gpiozero.Button(CONTROL_BUTTON_PIN),
+                                            self.analyzer, camera_service=self.camera_service, profiling=profiling,
+                                            governor=FrameRateGovernor(min_fps=2, max_fps=30),
+                                            dashboard=OfflineDashboard(), browser=OfflineBrowser())
+
+    def install(self, scene_factory):
+        """Point pop2 and the analysis core at the virtual clock and the fake camera."""
+        pop2.time = self.clock
+        pop2.datetime = sleep_analysis.datetime = virtual_datetime(self.clock)
+
+        def create_camera():
+            camera = FakePicamera2(scene_factory(), self.clock)
+            self.cameras.append(camera)
+            return camera
+
+        pop2.picamera2 = types.SimpleNamespace(Picamera2=create_camera)
+
+    def press_button(self):
+        self.button_pin.drive_low()
+        self.button_pin.drive_high()
+        # The press hands the action to a worker that holds the control lock until it is done
+        with self.interface.control_lock:
+            pass
+
+    def run(self):
+        wall_started = time.perf_counter()
+        with self.timer.measure("session start (wall)", time.perf_counter):
+            self.press_button()
+        sound_monitor = self.interface.sound_monitor
+        camera_monitor = self.interface.camera_monitor
+        camera = self.cameras[-1]
+
+        sound_high = False
+        next_frame = self.clock.now + camera.frame_interval
+        next_poll = self.clock.now + self.poll_interval
+        while min(next_frame, next_poll) < self.end:
+            if next_frame <= next_poll:
+                self.clock.now = next_frame
+                with self.timer.measure("camera capture"):
+                    frame = self.camera_service.read()
+                with self.timer.measure("camera processing"):
+                    camera_monitor.handle_frame(frame)
+                next_frame += camera.frame_interval
+            else:
+                self.clock.now = next_poll
+                level = self.script.sound_level(next_poll)
+                if level != sound_high:
+                    sound_high = level
+                    if level:
+                        self.sound_pin.drive_high()
+                    else:
+                        self.sound_pin.drive_low()
+                with self.timer.measure("sound polling"):
+                    sound_monitor.poll()
+                next_poll += self.poll_interval
+
+        self.clock.now = self.end
+        with self.timer.measure("session stop (wall)", time.perf_counter):
+            self.press_button()
+            self.interface.wait_for_finalizer()
+        return time.perf_counter() - wall_started
+
+    def close(self):
+        self.interface.display.clear_pending()
+        self.interface.display.stop()
+        self.interface.display.join()
+        self.camera_service.shutdown()
+
+def print_report(simulator, hours, wall_time, log_directory):
+    timer = simulator.timer
+    simulated = hours * 3600
+    print(f"Simulated {hours:g} h in {wall_time:.1f} s ({simulated / wall_time:.0f}x real time)")
+    print(f"{'component':<22} {'calls':>9} {'seconds':>8} {'us/call':>9}")
+    for component, seconds in timer.seconds.items():
+        calls = timer.calls[component]
+        print(f"{component:<22} {calls:>9} {seconds:>8.2f} {seconds / calls * 1e6:>9.1f}")
+    frames = timer.calls.get("camera processing", 0)
+    print(f"Camera: {frames} frames captured, {frames / wall_time:.0f} frames/s end to end")
+    print(f"LCD: {simulator.bus.transactions} I2C transactions, {simulator.bus.bytes_sent} bytes, "
+          f"screen now {simulator.bus.screen()}")
+    print(f"Script: {len(simulator.script.motion)} motion and {len(simulator.script.snoring)} snoring episodes")
+
+    log_files = sorted(f for f in os.listdir(log_directory) if f.startswith("sleep_log_") and f.endswith(".json"))
+    if log_files:
+        with open(os.path.join(log_directory, log_files[-1])) as f:
+            report = json.load(f).get("sleep_report", {})
+        if isinstance(report, dict):
+            print(f"Detected: {report.get('motion_events')} motion events, {report.get('sound_peaks')} sound peaks, "
+                  f"sleep score {report.get('sleep_score')}")
+        print(f"Session log: {os.path.join(log_directory, log_files[-1])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a night of sleep monitoring without hardware.")
+    parser.add_argument('--hours', type=float, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', type=datetime.fromisoformat, default=datetime(2024, 11, 2, 22, 30),
+                        help="Wall-clock time the night starts")
+    parser.add_argument('--recording', default=None, help="Video file or frame directory to loop instead of synthetic frames")
+    parser.add_argument('--sound-poll-hz', type=float, default=100,
+                        help="Sound sensor polling rate (the monitor polls at up to 1000 Hz on the Pi)")
+    parser.add_argument('--profile', action='store_true', help="Also collect pop2's per-stage profiles into the log")
+    parser.add_argument('--log-directory', default=None, help="Where to write the session log (default: a temporary directory)")
+    parser.add_argument('--verbose', action='store_true', help="Show the monitor's own console output")
+    args = parser.parse_args()
+
+    log_directory = args.log_directory or tempfile.mkdtemp(prefix="night_simulator_")
+    script = NightScript(args.start.timestamp(), hours=args.hours, seed=args.seed)
+    if args.recording:
+        recording = RecordedScene(args.recording)
+        scene_factory = lambda: recording
+    else:
+        scene_factory = lambda: SyntheticScene(script, seed=args.seed)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with output:
+        simulator = NightSimulator(scene_factory, script, args.start.timestamp(), args.hours, log_directory,
+                                   sound_poll_hz=args.sound_poll_hz, profiling=args.profile)
+        wall_time = simulator.run()
+        simulator.close()
+    print_report(simulator, args.hours, wall_time, log_directory)
+
+if __name__ == '__main__':
+    main()
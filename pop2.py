@@ -1,18 +1,27 @@
+import itertools
 import json
+from collections import deque, namedtuple
 from datetime import datetime
-import random
 import threading
-from gpiozero import LED, Button
 import time
-import cv2
-from picamera2 import Picamera2
-import smbus2
+import numpy as np
 import os
-import time
-import smbus2
-import webbrowser
+import queue
+import re
 import subprocess
-import socket
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lazy_module import LazyModule
+from session_ingest import SessionUploader, default_device_id
+from sleep_analysis import MotionEventTracker, SleepQualityAnalyzer
+
+cv2 = LazyModule("cv2")
+gpiozero = LazyModule("gpiozero")
+picamera2 = LazyModule("picamera2")
+smbus2 = LazyModule("smbus2")
 
 class LCD1602(object):
     # commands
@@ -53,11 +62,19 @@ class LCD1602(object):
     LCD_5x10DOTS = 0x04
     LCD_5x8DOTS = 0x00
 
-    def __init__(self, bus, lines, dotsize, lcd_addr=0x3e):
+    def __init__(self, bus, lines, dotsize, lcd_addr=0x3e, columns=16, block_writes=True):
         self.bus = bus  # SMBus instance
         self.lcd_address = lcd_addr
         self.line = lines
         self.currline = 0
+        self.columns = columns
+        # The controller accepts a run of data bytes after one 0x40 control byte, so text
+        # can go out as a single I2C block transaction instead of one per character
+        self.block_writes = block_writes
+        # Shadow copy of the display contents, so only changed cells are re-sent
+        self.shadow = [bytearray(b" " * columns) for _ in range(lines)]
+        self.cursor_col = 0
+        self.cursor_row = 0
         self.display_control = self.LCD_DISPLAYON
         if lines > 1:
             self.display_control |= self.LCD_2LINE
@@ -94,12 +111,18 @@ class LCD1602(object):
     def clear(self):
         self.command(self.LCD_CLEARDISPLAY)  # Clear display and reset cursor position
         time.sleep(0.002)  # This command takes a long time
+        for row in self.shadow:
+            row[:] = b" " * self.columns
+        self.cursor_col = self.cursor_row = 0
 
     def home(self):
         self.command(self.LCD_RETURNHOME)  # Set cursor position to zero
         time.sleep(0.002)  # This command takes a long time
+        self.cursor_col = self.cursor_row = 0
 
     def set_cursor(self, col, row):
+        self.cursor_col = col
+        self.cursor_row = row
         col = (col | 0x80) if row == 0 else (col | 0xc0)
         self.command(col)
 
@@ -140,150 +163,166 @@ class LCD1602(object):
 
     def write(self, char):
         self.bus.write_byte_data(self.lcd_address, 0x40, char)  # Send data
+        self.track_write(bytes([char]))
+
+    def write_data(self, data):
+        if self.block_writes:
+            self.bus.write_i2c_block_data(self.lcd_address, 0x40, list(data))  # Send data in one transaction
+            self.track_write(data)
+        else:
+            for char in data:
+                self.write(char)
+
+    def track_write(self, data):
+        # The controller advances the cursor after each character; mirror that in the shadow
+        if self.cursor_row < len(self.shadow):
+            row = self.shadow[self.cursor_row]
+            visible = data[:max(self.columns - self.cursor_col, 0)]
+            row[self.cursor_col:self.cursor_col + len(visible)] = visible
+        self.cursor_col += len(data)
 
     def print(self, text):
-        for char in text:
-            self.write(ord(char))
+        self.write_data(text.encode("ascii", "replace"))
+
+    def write_line(self, row, text):
+        """Make a row show text (padded to the display width), sending only changed cells."""
+        target = text.encode("ascii", "replace")[:self.columns].ljust(self.columns)
+        current = self.shadow[row]
+        col = 0
+        while col < self.columns:
+            if target[col] == current[col]:
+                col += 1
+                continue
+            end = col + 1
+            while end < self.columns:
+                if target[end] != current[end]:
+                    end += 1
+                elif self.block_writes:
+                    # Resending unchanged bytes inside a block is cheaper than another cursor move
+                    following = end
+                    while following < self.columns and target[following] == current[following]:
+                        following += 1
+                    if following == self.columns:
+                        break
+                    end = following
+                elif end + 1 < self.columns and target[end + 1] != current[end + 1]:
+                    end += 1  # A one-cell gap costs the same as the cursor move it saves
+                else:
+                    break
+            if (self.cursor_row, self.cursor_col) != (row, col):
+                self.set_cursor(col, row)
+            self.write_data(target[col:end])
+            col = end
+
+    def show(self, *lines):
+        """Update the whole display without clearing it, so unchanged text never flickers."""
+        for row in range(len(self.shadow)):
+            self.write_line(row, lines[row] if row < len(lines) else "")
 
 
-class SleepQualityAnalyzer:
-    def __init__(self, log_directory="sleep_logs"):
-        self.motion_events = []
-        self.sound_peaks = []
-        self.monitoring_start_time = None
-        self.monitoring_end_time = None
+class StageProfiler:
+    """Per-stage timing histograms and event counters for a monitoring pipeline.
+
+    Stage times are taken with perf_counter_ns and binned into power-of-two buckets,
+    so recording is a couple of integer operations and memory stays fixed.
+    """
+
+    enabled = True
+
+    def __init__(self):
         self.lock = threading.Lock()
-        self.log_directory = os.path.abspath(log_directory)
-        
-        # Ensure the log directory exists
-        os.makedirs(self.log_directory, exist_ok=True)
-        print(f"Log directory set to: {self.log_directory}")
+        self.histograms = {}  # stage -> counts per bucket, bucket b holding times in [2**(b-1), 2**b) ns
+        self.totals = {}  # stage -> [count, total_ns, max_ns]
+        self.counters = {}
 
-    def start_monitoring(self):
-        with self.lock:
-            self.monitoring_start_time = datetime.now()
-            self.motion_events.clear()
-            self.sound_peaks.clear()
-            print("Sleep quality monitoring started.")
+    def start(self):
+        return time.perf_counter_ns()
 
-    def stop_monitoring(self):
-        with self.lock:
-            self.monitoring_end_time = datetime.now()
-            print("Sleep quality monitoring stopped.")
+    def lap(self, stage, start_ns):
+        """Record the time since start_ns against stage and return the current time."""
+        now = time.perf_counter_ns()
+        self.record(stage, now - start_ns)
+        return now
 
-    def log_motion_event(self, start_time, end_time):
+    def record(self, stage, elapsed_ns):
+        bucket = elapsed_ns.bit_length()
         with self.lock:
-            duration = (end_time - start_time).total_seconds()
-            self.motion_events.append({"start": start_time, "end": end_time, "duration": duration})
-            print(f"Motion event logged from {start_time} to {end_time}, duration: {duration:.2f} seconds")
-
-    def log_sound_peak(self, timestamp):
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [0] * 64
+                self.totals[stage] = [0, 0, 0]
+            histogram[bucket] += 1
+            totals = self.totals[stage]
+            totals[0] += 1
+            totals[1] += elapsed_ns
+            if elapsed_ns > totals[2]:
+                totals[2] = elapsed_ns
+
+    def count(self, counter, amount=1):
         with self.lock:
-            self.sound_peaks.append(timestamp)
-            print(f"Sound peak logged at {timestamp}")
+            self.counters[counter] = self.counters.get(counter, 0) + amount
 
-    def calculate_sleep_score(self):
+    def set_counter(self, counter, value):
         with self.lock:
-            if not self.monitoring_start_time or not self.monitoring_end_time:
-                return None
-
-            # Calculate total monitoring duration in hours
-            total_duration = (self.monitoring_end_time - self.monitoring_start_time).total_seconds() / 3600  # in hours
-
-            if total_duration == 0:
-                return 50  # Default to 50 if the total duration is too short to evaluate
-
-            # 1. Calculate motion score
-            total_motion_duration = sum(event["duration"] for event in self.motion_events) / 3600  # in hours
-            motion_percentage = (total_motion_duration / total_duration) * 100
-            motion_penalty = min(motion_percentage * 1.5, 100)  # Adjusted to 1.5 points deduction per percentage of motion
-            motion_score = max(100 - motion_penalty, 10)  # Ensure a minimum motion score of 10
-
-            # 2. Calculate sound score
-            sound_frequency = len(self.sound_peaks) / total_duration  # Sound peaks per hour
-            sound_penalty = min(sound_frequency * 5, 100)  # Adjusted to 5 points deduction per sound peak per hour
-            sound_score = max(100 - sound_penalty, 10)  # Ensure a minimum sound score of 10
-
-            # 3. Calculate overall sleep score
-            # Adjust weightings dynamically if thereâ€™s too much movement or noise
-            if motion_percentage > 50:
-                motion_weight = 0.7  # Increase weight of motion if movement is very high
-                sound_weight = 0.3
-            elif sound_frequency > 20:
-                motion_weight = 0.4  # Increase weight of sound if noise is very high
-                sound_weight = 0.6
-            else:
-                motion_weight = 0.6  # Default weightings
-                sound_weight = 0.4
-
-            sleep_score = (motion_score * motion_weight) + (sound_score * sound_weight)
-
-            # Ensure a minimum sleep score to avoid 0
-            sleep_score = min(max(sleep_score, 15), 100)  # Minimum sleep score is 15
-
-            return round(sleep_score, 2)
-
-           
-
-    def generate_sleep_report(self):
-        sleep_score = self.calculate_sleep_score()
-        if sleep_score is None:
-            return "No monitoring data available."
-
-        total_duration = (self.monitoring_end_time - self.monitoring_start_time).total_seconds() / 3600  # in hours
-        total_motion_duration = sum(event["duration"] for event in self.motion_events) / 3600  # in hours
-        motion_percentage = (total_motion_duration / total_duration) * 100 if total_duration > 0 else 0
-
-        report = {
-            "sleep_score": sleep_score,
-            "monitoring_duration": f"{total_duration:.2f} hours",
-            "motion_events": len(self.motion_events),
-            "total_motion_duration": f"{total_motion_duration:.2f} hours",
-            "motion_percentage": f"{motion_percentage:.2f}%",
-            "sound_peaks": len(self.sound_peaks),
-            "sound_peaks_per_hour": round(len(self.sound_peaks) / total_duration, 2) if total_duration > 0 else 0
-        }
-
-        return report
-
-    def save_log(self):
+            self.counters[counter] = value
+
+    def summary(self):
         with self.lock:
-            if not self.monitoring_end_time:
-                self.monitoring_end_time = datetime.now()
-            
-            # Generate filename based on start and end time
-            start_time_str = self.monitoring_start_time.strftime("%Y%m%d_%H%M%S")
-            end_time_str = self.monitoring_end_time.strftime("%Y%m%d_%H%M%S")
-            filename = f"sleep_log_{start_time_str}_to_{end_time_str}.json"
-            filepath = os.path.join(self.log_directory, filename)
-
-            log_data = {
-                "start_time": self.monitoring_start_time.isoformat(),
-                "end_time": self.monitoring_end_time.isoformat(),
-                "motion_events": [
-                    {"start": event["start"].isoformat(), "end": event["end"].isoformat(), "duration": event["duration"]}
-                    for event in self.motion_events
-                ],
-                "sound_peaks": [peak.isoformat() for peak in self.sound_peaks]
-            }
-            
-            with open(filepath, 'w') as f:
-                json.dump(log_data, f, indent=2)
-            
-            return filepath
-
-    def append_report_to_log(self, filepath):
-        report = self.generate_sleep_report()
-        with open(filepath, 'r+') as f:
-            data = json.load(f)
-            data["sleep_report"] = report
-            f.seek(0)
-            json.dump(data, f, indent=2)
-            f.truncate()
-        return report
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                count, total_ns, max_ns = self.totals[stage]
+                stages[stage] = {
+                    "count": count,
+                    "mean_us": round(total_ns / count / 1000, 1),
+                    "max_us": round(max_ns / 1000, 1),
+                    # Percentiles are the upper edge of the bucket they fall in
+                    "p50_us": self.percentile_us(histogram, count, 0.50),
+                    "p95_us": self.percentile_us(histogram, count, 0.95),
+                    "p99_us": self.percentile_us(histogram, count, 0.99),
+                    "histogram_us": {
+                        str(round(2 ** bucket / 1000, 3)): bucket_count
+                        for bucket, bucket_count in enumerate(histogram) if bucket_count
+                    }
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    @staticmethod
+    def percentile_us(histogram, count, fraction):
+        target = fraction * count
+        seen = 0
+        for bucket, bucket_count in enumerate(histogram):
+            seen += bucket_count
+            if seen >= target:
+                return round(2 ** bucket / 1000, 3)
+        return None
+
+class NullProfiler:
+    """Stand-in used when profiling is off; every hook is a no-op."""
+
+    enabled = False
+
+    def start(self):
+        return 0
+
+    def lap(self, stage, start_ns):
+        return 0
+
+    def record(self, stage, elapsed_ns):
+        pass
+
+    def count(self, counter, amount=1):
+        pass
+
+    def set_counter(self, counter, value):
+        pass
+
+    def summary(self):
+        return None
+
+NULL_PROFILER = NullProfiler()
 
 class SoundMonitor(threading.Thread):
-    def __init__(self, sound_sensor_pin=27, threshold=5, detection_window=1.0, cooldown=0.1, analyzer=None):
+    def __init__(self, sound_sensor_pin=27, threshold=5, detection_window=1.0, cooldown=0.1, analyzer=None, profiler=None):
         super().__init__()
         self.sound_sensor_pin = sound_sensor_pin
         self.sound_sensor = None
@@ -295,15 +334,35 @@ class SoundMonitor(threading.Thread):
         self.last_peak_time = 0
         self.detections_in_window = 0
         self.window_start_time = time.time()
+        self.profiler = profiler or NULL_PROFILER
+        self.ready = threading.Event()  # Set once the sensor is being polled
+        self.live_time = None
 
     def run(self):
-        self.sound_sensor = Button(self.sound_sensor_pin, pull_up=False)
-        self.running = True
-        print("Sound monitoring started.")
+        self.open_sensor()
         while self.running:
-            if self.sound_sensor.is_pressed:
-                self.sound_detected()
+            self.poll()
             time.sleep(0.001)  # Increased responsiveness
+        self.finish()
+
+    def open_sensor(self):
+        self.sound_sensor = gpiozero.Button(self.sound_sensor_pin, pull_up=False)
+        self.running = True
+        self.live_time = time.time()
+        self.ready.set()
+        print("Sound monitoring started.")
+
+    def poll(self):
+        started = self.profiler.start()
+        self.profiler.count("loop_wakeups")
+        if self.sound_sensor.is_pressed:
+            self.profiler.count("sensor_triggers")
+            self.sound_detected()
+        self.profiler.lap("poll", started)
+
+    def finish(self):
+        if self.analyzer and self.profiler.enabled:
+            self.analyzer.record_profile("sound", self.profiler.summary())
 
     def sound_detected(self):
         current_time = time.time()
@@ -326,6 +385,7 @@ class SoundMonitor(threading.Thread):
             return  # Skip if we're still in the cooldown period
 
         self.last_peak_time = current_time
+        self.profiler.count("peaks")
         print("Peak detected!")
         
         # Log each peak as it occurs
@@ -338,128 +398,892 @@ class SoundMonitor(threading.Thread):
             self.sound_sensor.close()
         print("Sound monitoring stopped.")
 
-class InfraredCameraMonitor(threading.Thread):
-    def __init__(self, resolution=(640, 480), framerate=30, analyzer=None):
-        super().__init__()
-        self.camera = Picamera2()
-        config = self.camera.create_still_configuration(main={"size": resolution, "format": "RGB888"})
+class RegionOfInterest:
+    """Bed region of the camera frame, in full-frame pixel coordinates.
+
+    `crop` is an (x, y, width, height) rectangle processed instead of the whole frame,
+    `polygon` a list of (x, y) points outside which changes are ignored, and `zones`
+    maps names such as "head" or "legs" to (x, y, width, height) rectangles whose
+    motion is reported separately.
+    """
+
+    def __init__(self, crop=None, polygon=None, zones=None):
+        self.crop = tuple(crop) if crop else None
+        self.polygon = [tuple(point) for point in polygon] if polygon else None
+        self.zones = {name: tuple(rect) for name, rect in (zones or {}).items()}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            config = json.load(f)
+        return cls(config.get("crop"), config.get("polygon"), config.get("zones"))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({"crop": self.crop, "polygon": self.polygon, "zones": self.zones}, f, indent=2)
+
+    @property
+    def origin(self):
+        return self.crop[:2] if self.crop else (0, 0)
+
+    def crop_image(self, image):
+        if not self.crop:
+            return image
+        x, y, width, height = self.crop
+        return image[y:y + height, x:x + width]
+
+    def polygon_mask(self, shape):
+        """Full-resolution mask of the polygon for a cropped frame, or None."""
+        if not self.polygon:
+            return None
+        x0, y0 = self.origin
+        points = np.array([(x - x0, y - y0) for x, y in self.polygon], dtype=np.int32)
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        cv2.fillPoly(mask, [points], 255)
+        return mask
+
+    def zone_rects(self):
+        """Zone rectangles relative to the cropped frame."""
+        x0, y0 = self.origin
+        return {name: (x - x0, y - y0, width, height) for name, (x, y, width, height) in self.zones.items()}
+
+class MotionDetector:
+    """Base class for motion-detector engines used by InfraredCameraMonitor.
+
+    Engines allocate their working buffers once, for the first frame size seen, and
+    report the changed area of each frame in pixels through measure(). Their binary
+    change mask (`mask`, at 1/`mask_scale` of the frame resolution) drives the
+    region-of-interest polygon and per-zone accounting.
+    """
+
+    name = None
+    mask_scale = 1
+
+    def __init__(self, motion_threshold=1000, pixel_threshold=40, background_alpha=0.1, roi=None, zone_threshold=None):
+        self.motion_threshold = motion_threshold  # Minimum changed area (pixels) counted as motion
+        self.pixel_threshold = pixel_threshold  # Minimum per-pixel difference from the background
+        self.background_alpha = background_alpha  # Weight of the newest frame in the running background
+        self.roi = roi
+        self.zone_threshold = zone_threshold if zone_threshold is not None else motion_threshold
+        self.shape = None
+        self.motion_area = 0
+        self.zone_areas = {}
+        self.profiler = NULL_PROFILER
+
+    def reset(self):
+        self.shape = None
+        self.motion_area = 0
+
+    def allocate(self, shape):
+        raise NotImplementedError
+
+    def measure(self, image, first_frame):
+        raise NotImplementedError
+
+    def prepare_regions(self, shape):
+        scale = self.mask_scale
+        mask_shape = (shape[0] // scale, shape[1] // scale)
+        self.roi_mask = None
+        self.frame_area = shape[0] * shape[1]
+        self.zone_slices = {}
+        if not self.roi:
+            return
+
+        polygon_mask = self.roi.polygon_mask(shape)
+        if polygon_mask is not None:
+            self.frame_area = cv2.countNonZero(polygon_mask)
+            # Reduce to mask resolution; a cell belongs to the region if it is mostly inside
+            cells = polygon_mask[:mask_shape[0] * scale, :mask_shape[1] * scale]
+            cells = cells.reshape(mask_shape[0], scale, mask_shape[1], scale).mean(axis=(1, 3))
+            inside = cells >= 128
+            self.roi_mask = inside if self.mask_dtype is bool else inside.astype(np.uint8) * 255
+
+        for name, (x, y, width, height) in self.roi.zone_rects().items():
+            rows = slice(max(y, 0) // scale, max(y + height, 0) // scale)
+            cols = slice(max(x, 0) // scale, max(x + width, 0) // scale)
+            self.zone_slices[name] = (rows, cols)
+            self.zone_areas[name] = 0
+
+    @property
+    def motion_fraction(self):
+        return self.motion_area / self.frame_area if self.shape else 0
+
+    def detect(self, image):
+        if self.roi:
+            # Cropping is a view, so everything downstream touches only the bed region
+            image = self.roi.crop_image(image)
+        first_frame = self.shape != image.shape
+        if first_frame:
+            self.shape = image.shape
+            self.allocate(image.shape)
+            self.prepare_regions(image.shape)
+
+        self.motion_area = self.measure(image, first_frame)
+
+        cell_area = self.mask_scale * self.mask_scale
+        for name, (rows, cols) in self.zone_slices.items():
+            self.zone_areas[name] = 0 if first_frame else np.count_nonzero(self.mask[rows, cols]) * cell_area
+        return self.motion_area > self.motion_threshold
+
+    def zones_in_motion(self):
+        return {name: area > self.zone_threshold for name, area in self.zone_areas.items()}
+
+class DifferenceMotionDetector(MotionDetector):
+    """Blurred difference against a running-average background, thresholded to a mask."""
+
+    mask_dtype = np.uint8
+
+    def __init__(self, blur_size=(21, 21), **kwargs):
+        super().__init__(**kwargs)
+        self.blur_size = blur_size
+
+    def allocate(self, shape):
+        height, width = shape[:2]
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.blurred = np.empty((height, width), dtype=np.uint8)
+        self.background = np.empty((height, width), dtype=np.float32)
+        self.background_u8 = np.empty((height, width), dtype=np.uint8)
+        self.frame_delta = np.empty((height, width), dtype=np.uint8)
+        self.thresh = np.empty((height, width), dtype=np.uint8)
+        self.mask = self.thresh
+
+    def difference(self, image, first_frame):
+        profiler = self.profiler
+        lap = profiler.start()
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        lap = profiler.lap("cvtColor", lap)
+        cv2.GaussianBlur(self.gray, self.blur_size, 0, dst=self.blurred)
+        lap = profiler.lap("GaussianBlur", lap)
+
+        if first_frame:
+            # Seed the background model with the first frame
+            self.background[...] = self.blurred
+            return None
+
+        # Compare against the running average, then fold the new frame into it so that
+        # sensor noise and slow lighting drift are absorbed by the background
+        cv2.convertScaleAbs(self.background, dst=self.background_u8)
+        cv2.absdiff(self.background_u8, self.blurred, dst=self.frame_delta)
+        lap = profiler.lap("absdiff", lap)
+        cv2.accumulateWeighted(self.blurred, self.background, self.background_alpha)
+        lap = profiler.lap("accumulateWeighted", lap)
+
+        cv2.threshold(self.frame_delta, self.pixel_threshold, 255, cv2.THRESH_BINARY, dst=self.thresh)
+        if self.roi_mask is not None:
+            cv2.bitwise_and(self.thresh, self.roi_mask, dst=self.thresh)
+        profiler.lap("threshold", lap)
+        return self.thresh
+
+class ContourMotionDetector(DifferenceMotionDetector):
+    """Largest external contour of the dilated difference mask (the original strategy)."""
+
+    name = "contour"
+
+    def allocate(self, shape):
+        super().allocate(shape)
+        self.dilated = np.empty(self.thresh.shape, dtype=np.uint8)
+
+    def measure(self, image, first_frame):
+        thresh = self.difference(image, first_frame)
+        if thresh is None:
+            return 0
+
+        lap = self.profiler.start()
+        cv2.dilate(thresh, None, dst=self.dilated, iterations=2)
+        lap = self.profiler.lap("dilate", lap)
+        # OpenCV 4 no longer modifies the input image, so no defensive copy is needed
+        contours, _ = cv2.findContours(self.dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        self.profiler.lap("findContours", lap)
+
+        largest_area = 0
+        for contour in contours:
+            largest_area = max(largest_area, cv2.contourArea(contour))
+        return largest_area
+
+class PixelCountMotionDetector(DifferenceMotionDetector):
+    """Number of changed pixels in the difference mask, without dilation or contours."""
+
+    name = "pixel_count"
+
+    def measure(self, image, first_frame):
+        thresh = self.difference(image, first_frame)
+        if thresh is None:
+            return 0
+        lap = self.profiler.start()
+        changed = cv2.countNonZero(thresh)
+        self.profiler.lap("countNonZero", lap)
+        return changed
+
+class BlockMotionDetector(MotionDetector):
+    """Differences tile means instead of pixels; the tile averaging replaces the blur."""
+
+    name = "block"
+    mask_dtype = bool
+
+    def __init__(self, tile_size=8, pixel_threshold=20, **kwargs):
+        super().__init__(pixel_threshold=pixel_threshold, **kwargs)
+        self.tile_size = tile_size
+        self.mask_scale = tile_size
+
+    def allocate(self, shape):
+        # Frame edges that do not fill a whole tile are ignored
+        rows = shape[0] // self.tile_size
+        cols = shape[1] // self.tile_size
+        self.gray = np.empty((rows * self.tile_size, cols * self.tile_size), dtype=np.uint8)
+        self.row_sums = np.empty((rows, self.tile_size, cols), dtype=np.float32)
+        self.tiles = np.empty((rows, cols), dtype=np.float32)
+        self.background = np.empty((rows, cols), dtype=np.float32)
+        self.tile_delta = np.empty((rows, cols), dtype=np.float32)
+        self.abs_delta = np.empty((rows, cols), dtype=np.float32)
+        self.changed = np.empty((rows, cols), dtype=bool)
+        self.mask = self.changed
+        self.tile_view = self.gray.reshape(rows, self.tile_size, cols, self.tile_size)
+
+    def measure(self, image, first_frame):
+        profiler = self.profiler
+        lap = profiler.start()
+        height, width = self.gray.shape
+        cv2.cvtColor(image[:height, :width], cv2.COLOR_BGR2GRAY, dst=self.gray)
+        lap = profiler.lap("cvtColor", lap)
+        # Tile means via two single-axis reductions, which keeps numpy from allocating temporaries
+        np.sum(self.tile_view, axis=3, dtype=np.float32, out=self.row_sums)
+        np.sum(self.row_sums, axis=1, out=self.tiles)
+        np.multiply(self.tiles, 1.0 / (self.tile_size * self.tile_size), out=self.tiles)
+        lap = profiler.lap("tile_mean", lap)
+
+        if first_frame:
+            self.background[...] = self.tiles
+            self.changed[...] = False
+            return 0
+
+        np.subtract(self.tiles, self.background, out=self.tile_delta)
+        np.abs(self.tile_delta, out=self.abs_delta)
+        np.greater(self.abs_delta, self.pixel_threshold, out=self.changed)
+        if self.roi_mask is not None:
+            np.logical_and(self.changed, self.roi_mask, out=self.changed)
+
+        lap = profiler.lap("absdiff", lap)
+
+        # Running-average background update: background += alpha * (tiles - background)
+        np.multiply(self.tile_delta, self.background_alpha, out=self.tile_delta)
+        np.add(self.background, self.tile_delta, out=self.background)
+        profiler.lap("background", lap)
+
+        return np.count_nonzero(self.changed) * self.tile_size * self.tile_size
+
+MOTION_DETECTORS = {
+    engine.name: engine
+    for engine in (ContourMotionDetector, PixelCountMotionDetector, BlockMotionDetector)
+}
+
+def create_motion_detector(detector=None, **kwargs):
+    """Return a detector instance from an engine name, class or ready instance."""
+    if detector is None:
+        detector = ContourMotionDetector.name
+    if isinstance(detector, MotionDetector):
+        return detector
+    if isinstance(detector, str):
+        if detector not in MOTION_DETECTORS:
+            raise ValueError(f"Unknown motion detector '{detector}', expected one of {sorted(MOTION_DETECTORS)}")
+        detector = MOTION_DETECTORS[detector]
+    return detector(**kwargs)
+
+Frame = namedtuple("Frame", ["image", "timestamp"])  # timestamp: wall-clock seconds when the frame was exposed
+
+class FrameQueue:
+    """Bounded frame queue that drops the oldest frame when the consumer falls behind.
+
+    With drop_oldest=False the producer blocks instead, so recorded sources lose no frames.
+    """
+
+    def __init__(self, maxsize=4, drop_oldest=True):
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.condition:
+            if not self.drop_oldest:
+                while len(self.frames) >= self.maxsize and not self.closed:
+                    self.condition.wait()
+            elif len(self.frames) >= self.maxsize:
+                self.frames.popleft()
+                self.dropped += 1
+            self.frames.append(frame)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.frames and not self.closed:
+                self.condition.wait(timeout)
+            if self.frames:
+                frame = self.frames.popleft()
+                self.condition.notify_all()
+                return frame
+            return None
+
+    def finished(self):
+        with self.condition:
+            return self.closed and not self.frames
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+def sensor_timestamp_to_wall_clock(metadata):
+    # libcamera's SensorTimestamp counts nanoseconds on CLOCK_BOOTTIME
+    sensor_ns = metadata.get("SensorTimestamp") if metadata else None
+    if sensor_ns is None:
+        return time.time()
+    age_ns = time.clock_gettime_ns(time.CLOCK_BOOTTIME) - sensor_ns
+    return time.time() - age_ns / 1e9
+
+FRAME_DUMP_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.npy')
+
+def parse_recording_start(path):
+    """Read a YYYYmmdd_HHMMSS start time from a recording's file or directory name."""
+    match = re.search(r"(\d{8})_(\d{6})", os.path.basename(os.path.normpath(path)))
+    if match:
+        return datetime.strptime(match.group(1) + match.group(2), "%Y%m%d%H%M%S")
+    return None
+
+class Picamera2Source:
+    """Live frames from the Raspberry Pi camera."""
+
+    live = True
+
+    def __init__(self, resolution=(640, 480), framerate=30):
+        self.camera = picamera2.Picamera2()
+        # A video configuration keeps several buffers in flight for continuous capture
+        config = self.camera.create_video_configuration(main={"size": resolution, "format": "RGB888"})
         self.camera.configure(config)
         self.camera.set_controls({"FrameDurationLimits": (int(1/framerate*1000000), int(1/framerate*1000000))})
-        self.prev_frame = None
-        self.motion_threshold = 1000
-        self.analyzer = analyzer
+
+    def start(self):
+        self.camera.start()
+        time.sleep(2)  # Let exposure settle before the first frame
+
+    def set_framerate(self, framerate):
+        frame_duration = int(1/framerate*1000000)
+        self.camera.set_controls({"FrameDurationLimits": (frame_duration, frame_duration)})
+
+    def read(self):
+        request = self.camera.capture_request()
+        try:
+            image = request.make_array("main")
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        return Frame(image, sensor_timestamp_to_wall_clock(metadata))
+
+    def close(self):
+        self.camera.close()
+
+class CameraService:
+    """Picamera2 opened once at startup and kept streaming between monitoring sessions.
+
+    It is a frame source whose start() and close() only attach and detach a session,
+    so a new session gets frames straight away instead of re-initialising the camera.
+    """
+
+    live = True
+
+    def __init__(self, resolution=(640, 480), framerate=30):
+        self.source = Picamera2Source(resolution, framerate)
+        self.lock = threading.Lock()
+        self.attached = False
+
+    def open(self):
+        self.source.start()
+        print("Camera service ready.")
+
+    def start(self):
+        with self.lock:
+            if self.attached:
+                raise RuntimeError("Camera service is already attached to a session")
+            self.attached = True
+
+    def read(self):
+        return self.source.read()
+
+    def set_framerate(self, framerate):
+        self.source.set_framerate(framerate)
+
+    def close(self):
+        with self.lock:
+            self.attached = False
+
+    def shutdown(self):
+        self.close()
+        self.source.close()
+        print("Camera service closed.")
+
+class VideoFileSource:
+    """Frames replayed from a recorded video; timestamps follow the recording's frame rate."""
+
+    live = False
+
+    def __init__(self, path, start_time=None, fps=None):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video file: {path}")
+        self.fps = fps or self.capture.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        start_time = start_time or parse_recording_start(path)
+        if start_time is None:
+            raise ValueError(f"Recording start time unknown for {path}")
+        self.start_time = start_time.timestamp()
+        self.position = 0
+
+    def start(self):
+        pass
+
+    def seek(self, index):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.position = index
+
+    def read(self):
+        ok, image = self.capture.read()
+        if not ok:
+            return None
+        timestamp = self.start_time + self.position / self.fps
+        self.position += 1
+        return Frame(image, timestamp)
+
+    def close(self):
+        self.capture.release()
+
+class FrameDumpSource:
+    """Frames replayed from a directory of images or .npy arrays, in filename order.
+
+    Files named after their capture time in 13-digit epoch milliseconds (e.g. 1730556785123.png)
+    keep that timestamp; other names are spaced 1/fps apart from start_time.
+    """
+
+    live = False
+
+    def __init__(self, directory, start_time=None, fps=10):
+        self.directory = directory
+        self.files = sorted(f for f in os.listdir(directory) if f.lower().endswith(FRAME_DUMP_EXTENSIONS))
+        self.fps = fps
+        self.frame_count = len(self.files)
+        start_time = start_time or parse_recording_start(directory)
+        self.start_time = start_time.timestamp() if start_time else None
+        self.position = 0
+
+    def start(self):
+        pass
+
+    def seek(self, index):
+        self.position = index
+
+    def frame_timestamp(self, index):
+        stem = os.path.splitext(self.files[index])[0]
+        if stem.isdigit() and len(stem) == 13:
+            return int(stem) / 1000
+        if self.start_time is None:
+            raise ValueError(f"Recording start time unknown for {self.directory}")
+        return self.start_time + index / self.fps
+
+    def read(self):
+        if self.position >= self.frame_count:
+            return None
+        name = self.files[self.position]
+        file_path = os.path.join(self.directory, name)
+        image = np.load(file_path) if name.endswith('.npy') else cv2.imread(file_path, cv2.IMREAD_COLOR)
+        frame = Frame(image, self.frame_timestamp(self.position))
+        self.position += 1
+        return frame
+
+    def close(self):
+        pass
+
+def open_frame_source(path, start_time=None, fps=None):
+    """Open a recorded night as a video file or frame-dump directory source."""
+    if os.path.isdir(path):
+        return FrameDumpSource(path, start_time=start_time, fps=fps or 10)
+    return VideoFileSource(path, start_time=start_time, fps=fps)
+
+class FrameCaptureThread(threading.Thread):
+    def __init__(self, source, frame_queue, profiler=None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.frame_queue = frame_queue
         self.running = False
-        self.motion_ongoing = False
-        self.motion_start_time = None
-        self.motion_cooldown = 3  # Time in seconds to wait before considering a new motion event
+        self.profiler = profiler or NULL_PROFILER
 
     def run(self):
-        self.camera.start()
         self.running = True
-        time.sleep(2)
-        print("Camera monitoring started.")
-        while self.running:
-            image = self.camera.capture_array()
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (21, 21), 0)
+        profiler = self.profiler
+        try:
+            while self.running:
+                started = profiler.start()
+                frame = self.source.read()
+                if frame is None:
+                    break  # End of a recorded source
+                profiler.lap("capture_array", started)
+                profiler.count("frames_captured")
+                self.frame_queue.put(frame)
+        finally:
+            self.frame_queue.close()
 
-            if self.prev_frame is None:
-                self.prev_frame = gray
-                continue
+    def stop(self):
+        self.running = False
 
-            frame_delta = cv2.absdiff(self.prev_frame, gray)
-            thresh = cv2.threshold(frame_delta, 40, 255, cv2.THRESH_BINARY)[1]
-            thresh = cv2.dilate(thresh, None, iterations=2)
-            contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+class FrameRateGovernor:
+    """Chooses the camera sampling rate from the motion metric.
+
+    The rate jumps to max_fps as soon as the changed area rises above rise_fraction of
+    the motion threshold, so the onset of an event is sampled at full rate. Once the
+    scene has been quiet for quiet_seconds, the rate is multiplied by ramp_down_factor
+    every ramp_down_interval seconds until it reaches min_fps.
+    """
+
+    def __init__(self, min_fps=2, max_fps=30, rise_fraction=0.25, quiet_seconds=10, ramp_down_factor=0.5,
+                 ramp_down_interval=5):
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.rise_fraction = rise_fraction
+        self.quiet_seconds = quiet_seconds
+        self.ramp_down_factor = ramp_down_factor
+        self.ramp_down_interval = ramp_down_interval
+        self.reset()
+
+    def reset(self):
+        self.fps = self.max_fps
+        self.last_activity = None
+        self.last_change = None
+
+    def update(self, motion_area, motion_threshold, timestamp):
+        if self.last_activity is None:
+            self.last_activity = self.last_change = timestamp
+
+        if motion_area > self.rise_fraction * motion_threshold:
+            self.last_activity = timestamp
+            if self.fps != self.max_fps:
+                self.fps = self.max_fps
+                self.last_change = timestamp
+        elif (self.fps > self.min_fps
+              and timestamp - self.last_activity >= self.quiet_seconds
+              and timestamp - self.last_change >= self.ramp_down_interval):
+            self.fps = max(self.min_fps, self.fps * self.ramp_down_factor)
+            self.last_change = timestamp
+        return self.fps
 
-            motion_detected = False
-            for contour in contours:
-                if cv2.contourArea(contour) > self.motion_threshold:
-                    motion_detected = True
-                    break
+class InfraredCameraMonitor(threading.Thread):
+    def __init__(self, resolution=(640, 480), framerate=30, analyzer=None, detector=None, queue_size=4, source=None, roi=None,
+                 profiler=None, governor=None):
+        super().__init__()
+        self.source = source or Picamera2Source(resolution, framerate)
+        self.detector = create_motion_detector(detector, roi=roi)
+        self.motion_threshold = self.detector.motion_threshold
+        self.analyzer = analyzer
+        self.running = False
+        self.profiler = profiler or NULL_PROFILER
+        self.detector.profiler = self.profiler
+        # Live cameras drop stale frames under backpressure; recordings are replayed in full
+        self.frame_queue = FrameQueue(queue_size, drop_oldest=self.source.live)
+        self.capture_thread = FrameCaptureThread(self.source, self.frame_queue, self.profiler)
+        self.motion_tracker = MotionEventTracker()
+        zones = self.detector.roi.zones if self.detector.roi else {}
+        self.zone_trackers = {name: MotionEventTracker() for name in zones}
+        self.governor = governor
+        self.current_fps = None
+        self.next_frame_due = 0
+        self.ready = threading.Event()  # Set once the first frame has been processed
+        self.live_time = None
 
-            current_time = time.time()
-
-            if motion_detected and not self.motion_ongoing:
-                # Start of a new motion event
-                self.motion_ongoing = True
-                self.motion_start_time = current_time
-                print("Motion started!")
-            elif not motion_detected and self.motion_ongoing:
-                # Potential end of motion event
-                if current_time - self.motion_start_time > self.motion_cooldown:
-                    # Motion has stopped for longer than the cooldown period
-                    self.motion_ongoing = False
-                    motion_end_time = current_time
-                    print(f"Motion ended! Duration: {motion_end_time - self.motion_start_time:.2f} seconds")
-                    if self.analyzer:
-                        self.analyzer.log_motion_event(
-                            datetime.fromtimestamp(self.motion_start_time),
-                            datetime.fromtimestamp(motion_end_time)
-                        )
-
-            self.prev_frame = gray
-            time.sleep(0.1)
+    def run(self):
+        self.begin()
+        self.capture_thread.start()
+        try:
+            while self.running and not self.frame_queue.finished():
+                frame = self.frame_queue.get(timeout=0.5)
+                self.profiler.count("loop_wakeups")
+                if frame is not None:
+                    self.handle_frame(frame)
+        finally:
+            self.capture_thread.stop()
+            self.frame_queue.close()
+            self.capture_thread.join()
+            self.finish()
+
+    def begin(self):
+        self.source.start()
+        self.running = True
+        print("Camera monitoring started.")
+        self.detector.reset()
+        if self.governor:
+            self.governor.reset()
+            # A warm camera service still runs at the rate the last session ramped down to
+            self.current_fps = self.governor.fps
+            self.next_frame_due = 0
+            if hasattr(self.source, "set_framerate"):
+                self.source.set_framerate(self.current_fps)
+            if self.analyzer:
+                # The starting rate, so the log's history of rates covers the whole session
+                self.analyzer.log_frame_rate(datetime.now(), self.current_fps)
+        if self.analyzer and self.zone_trackers:
+            self.analyzer.set_motion_zones(self.zone_trackers)
+
+    def handle_frame(self, frame):
+        if frame.timestamp < self.next_frame_due:
+            # Sources that cannot slow down are thinned to the governed rate instead
+            self.profiler.count("frames_skipped")
+            return
+        started = self.profiler.start()
+        self.process_frame(frame)
+        self.profiler.lap("process_frame", started)
+        self.profiler.count("frames_processed")
+        if self.governor:
+            self.govern_frame_rate(frame.timestamp)
+        if not self.ready.is_set():
+            self.live_time = frame.timestamp
+            self.ready.set()
+
+    def finish(self):
+        self.source.close()
+        if self.analyzer and self.profiler.enabled:
+            self.analyzer.record_profile("camera", self.profile_summary())
+
+    def govern_frame_rate(self, timestamp):
+        fps = self.governor.update(self.detector.motion_area, self.detector.motion_threshold, timestamp)
+        if fps != self.current_fps:
+            self.current_fps = fps
+            if hasattr(self.source, "set_framerate"):
+                self.source.set_framerate(fps)
+            if self.analyzer:
+                self.analyzer.log_frame_rate(datetime.fromtimestamp(timestamp), fps)
+        # Allow some capture jitter so frames at exactly the governed rate are not skipped
+        self.next_frame_due = timestamp + 0.9 / fps
+
+    def profile_summary(self):
+        self.profiler.set_counter("frames_dropped", self.frame_queue.dropped)
+        return self.profiler.summary()
+
+    def process_frame(self, frame):
+        motion_detected = self.detector.detect(frame.image)
+        if self.analyzer:
+            # Changed area as a fraction of the region watched, so values compare across setups
+            self.analyzer.log_motion_intensity(frame.timestamp, self.detector.motion_fraction)
+        if self.zone_trackers:
+            self.process_zones(frame.timestamp)
+        was_ongoing = self.motion_tracker.motion_ongoing
+        event = self.motion_tracker.update(motion_detected, frame.timestamp)
+
+        if self.motion_tracker.motion_ongoing and not was_ongoing:
+            print("Motion started!")
+        elif event:
+            motion_start_time, motion_end_time = event
+            print(f"Motion ended! Duration: {motion_end_time - motion_start_time:.2f} seconds")
+            if self.analyzer:
+                self.analyzer.log_motion_event(
+                    datetime.fromtimestamp(motion_start_time),
+                    datetime.fromtimestamp(motion_end_time)
+                )
+
+    def process_zones(self, timestamp):
+        for name, zone_motion in self.detector.zones_in_motion().items():
+            event = self.zone_trackers[name].update(zone_motion, timestamp)
+            if event and self.analyzer:
+                self.analyzer.log_zone_motion_event(
+                    name,
+                    datetime.fromtimestamp(event[0]),
+                    datetime.fromtimestamp(event[1])
+                )
 
     def stop(self):
         self.running = False
-        self.camera.close()
-        print("Camera monitoring stopped.")
+        self.frame_queue.close()
+        if not self.is_alive():
+            self.source.close()
+        print(f"Camera monitoring stopped. Frames dropped: {self.frame_queue.dropped}")
+
+class DisplayWorker(threading.Thread):
+    """Owns the LCD and shows queued screens, so callers never wait on the display.
+
+    Screens are shown in priority order (lower value first) and held for their
+    duration, unless a more urgent screen arrives. A screen with no duration is
+    skipped when a screen at least as urgent is already waiting, since nobody would
+    see it. An idle screen queued before a later status screen is out of date and
+    dropped.
+    """
+
+    PRIORITY_URGENT = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_IDLE = 2
+
+    def __init__(self, lcd):
+        super().__init__(daemon=True)
+        self.lcd = lcd
+        self.screens = queue.PriorityQueue()
+        self.sequence = itertools.count()  # Keeps screens of equal priority in arrival order
+        self.preempt = threading.Event()
+        self.current_priority = None
+        self.status_sequence = -1  # Sequence number of the latest status (non-idle, no duration) screen
+
+    def show(self, line1, line2="", duration=0, priority=PRIORITY_NORMAL):
+        self.screens.put((priority, next(self.sequence), (line1, line2, duration)))
+        if self.current_priority is not None and priority < self.current_priority:
+            self.preempt.set()
+
+    def clear_pending(self):
+        """Drop every waiting screen and stop holding the current one."""
+        while True:
+            try:
+                self.screens.get_nowait()
+            except queue.Empty:
+                break
+        if self.current_priority is not None:
+            self.preempt.set()
+
+    def next_priority(self):
+        """Priority of the most urgent waiting screen, or None if none is waiting."""
+        with self.screens.mutex:
+            return self.screens.queue[0][0] if self.screens.queue else None
+
+    def run(self):
+        while True:
+            priority, sequence, screen = self.screens.get()
+            if screen is None:
+                break
+            line1, line2, duration = screen
+            if priority == self.PRIORITY_IDLE and sequence < self.status_sequence:
+                continue
+            if duration == 0:
+                if priority < self.PRIORITY_IDLE:
+                    self.status_sequence = max(self.status_sequence, sequence)
+                waiting = self.next_priority()
+                if waiting is not None and waiting <= priority:
+                    continue
+            self.lcd.show(line1, line2)
+            if duration:
+                self.current_priority = priority
+                self.preempt.wait(duration)
+                self.preempt.clear()
+                self.current_priority = None
+
+    def stop(self):
+        # Queued behind every screen, so pending messages are still shown before exiting
+        self.screens.put((self.PRIORITY_IDLE + 1, next(self.sequence), None))
 
 class LCDButtonInterface:
-    def __init__(self, lcd, button, analyzer):
+    def __init__(self, lcd, button, analyzer, roi=None, camera_service=None, profiling=False, governor=None,
+                 startup_timeout=5, dashboard=None, browser=None, uploader=None):
         self.lcd = lcd
         self.button = button
         self.analyzer = analyzer
+        self.roi = roi
+        self.camera_service = camera_service
+        self.profiling = profiling
+        self.governor = governor
+        self.startup_timeout = startup_timeout  # Seconds to wait for the sensors before starting anyway
+        self.dashboard = dashboard or DashboardServer()
+        self.browser = browser or DashboardBrowser(self.dashboard.url)
+        self.uploader = uploader  # Sends finished sessions to a central dashboard, if one is configured
         self.sound_monitor = None
         self.camera_monitor = None
+        self.finalizer = None
+        self.log_saved = threading.Event()  # Set once the finalizer has written the last session's log
+        self.log_saved.set()
+        self.session = 0  # Sessions started so far; a finalizer's screens are dropped once the next one starts
+        self.session_lock = threading.Lock()
         self.monitoring = False
+        self.control_lock = threading.Lock()  # Serializes button presses and local control requests
+        self.display = DisplayWorker(lcd)
+        self.display.start()
         self.button.when_pressed = self.toggle_monitoring
-        self.idle_timer = None
 
     def toggle_monitoring(self):
-        if self.monitoring:
-            self.stop_monitoring()
-        else:
-            self.start_monitoring()
+        # Runs in gpiozero's callback thread: acknowledge and hand the work off immediately
+        if not self.control_lock.acquire(blocking=False):
+            self.display_message("Please Wait", "Busy...", duration=1, priority=DisplayWorker.PRIORITY_URGENT)
+            return
+        action = self.stop_monitoring if self.monitoring else self.start_monitoring
+        threading.Thread(target=self.run_control_action, args=(action,), daemon=True).start()
+
+    def run_control_action(self, action):
+        try:
+            action()
+        except Exception as e:
+            print(f"Error during {action.__name__}: {e}")
+            self.display_message("Error:", action.__name__[:16], duration=2)
+        finally:
+            self.control_lock.release()
+
+    def new_profiler(self):
+        return StageProfiler() if self.profiling else None
+
+    def status(self):
+        status = {"monitoring": self.monitoring}
+        if self.profiling:
+            # Monitors may be swapped out by a concurrent start/stop, so read each once
+            sound_monitor = self.sound_monitor
+            camera_monitor = self.camera_monitor
+            status["profiling"] = {
+                "sound": sound_monitor.profiler.summary() if sound_monitor else None,
+                "camera": camera_monitor.profile_summary() if camera_monitor else None
+            }
+        return status
+
+    def display_message(self, line1, line2="", duration=0, priority=DisplayWorker.PRIORITY_NORMAL):
+        self.display.show(line1, line2, duration, priority)
 
-    def display_message(self, line1, line2=""):
-        self.lcd.clear()
-        self.lcd.print(line1)
-        if line2:
-            self.lcd.set_cursor(0, 1)
-            self.lcd.print(line2)
+    def create_monitors(self):
+        sound_monitor = SoundMonitor(analyzer=self.analyzer, profiler=self.new_profiler())
+        camera_monitor = InfraredCameraMonitor(analyzer=self.analyzer, roi=self.roi, source=self.camera_service,
+                                               profiler=self.new_profiler(), governor=self.governor)
+        return sound_monitor, camera_monitor
 
     def start_monitoring(self):
         if not self.monitoring:
-            self.cancel_idle_timer()
+            with self.session_lock:
+                self.session += 1
+            requested_time = time.time()
+            # The analyzer is reset below, so the previous night has to be on disk first. Opening
+            # its report can go on in the background; its screens are no longer shown.
+            self.log_saved.wait()
+            self.display.clear_pending()
             self.display_message("Starting", "Monitoring...")
-            time.sleep(1)
 
             self.analyzer.start_monitoring()
 
-            self.display_message("Initializing", "Sound Monitor")
-            self.sound_monitor = SoundMonitor(analyzer=self.analyzer)
+            # Both monitors come up in parallel; the session starts when the slower one is live
+            self.display_message("Initializing", "Sensors...")
+            self.sound_monitor, self.camera_monitor = self.create_monitors()
             self.sound_monitor.start()
-            time.sleep(1)
-
-            self.display_message("Initializing", "Camera Monitor")
-            self.camera_monitor = InfraredCameraMonitor(analyzer=self.analyzer)
             self.camera_monitor.start()
-            time.sleep(1)
+
+            deadline = requested_time + self.startup_timeout
+            startup = {}
+            for name, monitor in (("sound", self.sound_monitor), ("camera", self.camera_monitor)):
+                if monitor.ready.wait(max(deadline - time.time(), 0)):
+                    startup[name] = round(monitor.live_time - requested_time, 3)
+                else:
+                    print(f"{name.capitalize()} monitor not live after {self.startup_timeout} seconds.")
+                    self.display_message("Slow Start:", name.capitalize(), duration=2, priority=DisplayWorker.PRIORITY_URGENT)
+            if startup:
+                live_time = requested_time + max(startup.values())
+                self.analyzer.mark_live(datetime.fromtimestamp(live_time), startup)
 
             self.display_message("Monitoring", "Active")
             self.monitoring = True
             print("Monitoring started.")
         else:
-            self.display_message("Already", "Monitoring")
-            time.sleep(2)
+            self.display_message("Already", "Monitoring", duration=2)
             self.display_message("Monitoring", "Active")
 
     def stop_monitoring(self):
         if self.monitoring:
+            self.display.clear_pending()
             self.display_message("Stopping", "Monitoring...")
-            time.sleep(1)
 
             if self.sound_monitor:
                 self.sound_monitor.stop()
@@ -472,183 +1296,289 @@ class LCDButtonInterface:
                 self.camera_monitor = None
 
             self.analyzer.stop_monitoring()
+            self.monitoring = False
 
+            # Writing the log and opening the report happen on their own thread
             self.display_message("Saving Log", "Please Wait...")
-            log_file = self.analyzer.save_log()
-            time.sleep(1)
-
-            self.display_message("Generating", "Sleep Report")
-            report = self.analyzer.append_report_to_log(log_file)
-            time.sleep(2)
-
-            if isinstance(report, dict):
-                sleep_score = report.get("sleep_score", 0)
-                self.display_message(f"Sleep Score:", f"{sleep_score:.2f}")
-                time.sleep(3)
-            
-                # Launch web interface after showing sleep score
-                self.display_message("Opening", "Web Report...")
-                self.launch_web_interface()
-            else:
-                self.display_message("Error:", "No Valid Report")
-                time.sleep(1)
-
-            self.monitoring = False
-            print("Monitoring stopped and report saved.")
-            self.schedule_idle_message()
+            self.log_saved = threading.Event()
+            self.finalizer = threading.Thread(target=self.finalize_session, args=(self.session, self.log_saved))
+            self.finalizer.start()
         else:
-            self.display_message("Not Currently", "Monitoring")
-            time.sleep(2)
+            self.display_message("Not Currently", "Monitoring", duration=2)
             self.show_idle_message()
 
-    def show_idle_message(self):
-        self.display_message("Press Button", "to Start/Stop")
-
-    def schedule_idle_message(self):
-        self.cancel_idle_timer()
-        self.idle_timer = threading.Timer(5.0, self.show_idle_message)
-        self.idle_timer.start()
+    def finalize_session(self, session, log_saved):
+        try:
+            log_file, report = self.analyzer.finalize_session()
+        finally:
+            log_saved.set()
 
-    def cancel_idle_timer(self):
-        if self.idle_timer:
-            self.idle_timer.cancel()
-            self.idle_timer = None
+        if isinstance(report, dict):
+            sleep_score = report.get("sleep_score", 0)
+            self.session_message(session, f"Sleep Score:", f"{sleep_score:.1f}", duration=3)  # Show score for 3 seconds
+        else:
+            self.session_message(session, "Error:", "No Valid Report", duration=1)
+        print(f"Monitoring stopped and report saved to {log_file}.")
+
+        # Launch web interface after saving the report
+        self.session_message(session, "Opening", "Web Report...")
+        self.launch_web_interface(session)
+        self.show_idle_message(session)
+        if self.uploader:
+            self.uploader.request_upload()
+
+    def wait_for_finalizer(self):
+        if self.finalizer:
+            self.finalizer.join()
+            self.finalizer = None
+
+    def session_message(self, session, line1, line2="", duration=0, priority=DisplayWorker.PRIORITY_NORMAL):
+        """display_message for a finished session, dropped once a newer session has started.
+
+        start_monitoring() clears the queue after counting the new session, so a screen
+        either goes in before that and is cleared, or is never queued.
+        """
+        with self.session_lock:
+            if session is None or session == self.session:
+                self.display_message(line1, line2, duration, priority)
+
+    def show_idle_message(self, session=None):
+        self.session_message(session, "Press Button", "to Start/Stop", priority=DisplayWorker.PRIORITY_IDLE)
 
     def cleanup(self):
-        self.cancel_idle_timer()
-        if self.monitoring:
-            self.stop_monitoring()
+        with self.control_lock:
+            if self.monitoring:
+                self.stop_monitoring()
+            self.wait_for_finalizer()
         if self.button:
             self.button.close()
+        self.display.clear_pending()
+        self.display_message("System", "Shutting Down", duration=2)
+        self.display.stop()
+        self.display.join()
         if self.lcd:
-            self.display_message("System", "Shutting Down")
-            time.sleep(2)
             self.lcd.clear()
 
-    def stop_monitoring(self):
-        if self.monitoring:
-            self.display_message("Stopping", "Monitoring...")
-            time.sleep(1)
+    def launch_web_interface(self, session=None):
+        try:
+            if not self.dashboard.ensure_running():
+                self.session_message(session, "Error Start", "Flask Server", duration=2)
+                return
+            # The page the browser opens is served from the snapshot, so bring it up to date first
+            self.dashboard.refresh_snapshot()
+            self.browser.show()
+            self.session_message(session, "Web Interface", "Launched", duration=2)
 
-            if self.sound_monitor:
-                self.sound_monitor.stop()
-                self.sound_monitor.join()
-                self.sound_monitor = None
+        except Exception as e:
+            print(f"Error launching web interface: {e}")
+            self.session_message(session, "Error Launch", "Web Interface", duration=2)
 
-            if self.camera_monitor:
-                self.camera_monitor.stop()
-                self.camera_monitor.join()
-                self.camera_monitor = None
+class DashboardServer:
+    """The Flask dashboard (app.py) kept running as a child process of the monitor.
 
-            self.analyzer.stop_monitoring()
+    A dashboard that is already being served on the port, for example one started by
+    hand, is used as it is.
+    """
 
-            self.display_message("Saving Log", "Please Wait...")
-            log_file = self.analyzer.save_log()
-            time.sleep(1)
-
-            self.display_message("Generating", "Sleep Report")
-            report = self.analyzer.append_report_to_log(log_file)
-            time.sleep(2)
-
-            if isinstance(report, dict):
-                sleep_score = report.get("sleep_score", 0)
-                self.display_message(f"Sleep Score:", f"{sleep_score:.1f}")
-                time.sleep(3)  # Show score for 3 seconds
-                # self.display_message(f"Log Saved:", f"{os.path.basename(log_file)[:16]}")
-                # time.sleep(3)  # Show log filename for 3 seconds
-            else:
-                self.display_message("Error:", "No Valid Report")
-                time.sleep(1)
-
-            # Launch web interface after saving the report
-            self.display_message("Opening", "Web Report...")
-            self.launch_web_interface()
+    def __init__(self, app_path="/home/luna/Documents/app.py", url="http://127.0.0.1:5000"):
+        self.app_path = app_path
+        self.url = url
+        self.process = None
 
-            self.monitoring = False
-            print("Monitoring stopped and report saved.")
-            self.schedule_idle_message()
+    def is_ready(self):
+        try:
+            with urllib.request.urlopen(self.url + "/healthz", timeout=0.5) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def start(self):
+        """Spawn app.py unless it is already serving or starting up."""
+        if self.process and self.process.poll() is None:
+            return
+        if self.is_ready():
+            return
+        if self.process:
+            print(f"Dashboard server exited with code {self.process.returncode}, restarting.")
+        env = os.environ.copy()
+        env["SLEEP_DASHBOARD_SUPERVISED"] = "1"
+        self.process = subprocess.Popen(["python3", self.app_path], env=env)
+
+    def ensure_running(self, timeout=15):
+        """Start the server if needed and wait until it answers its readiness probe."""
+        deadline = time.time() + timeout
+        self.start()
+        while time.time() < deadline:
+            if self.is_ready():
+                return True
+            if self.process and self.process.poll() is not None:
+                break
+            time.sleep(0.05)
+        print("Dashboard server did not become ready.")
+        return False
+
+    def refresh_snapshot(self):
+        """Have the dashboard re-render its snapshot (see dashboard_snapshot) after a session ended."""
+        try:
+            request = urllib.request.Request(self.url + "/api/snapshot", data=b"", method="POST")
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Error refreshing dashboard snapshot: {e}")
+            return False
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+class DashboardBrowser:
+    """Chromium window showing the dashboard, reused through its remote-debugging port.
+
+    The first report launches the browser; later ones open the dashboard in a fresh
+    tab of that browser and close the stale dashboard tabs, so windows don't pile up.
+    """
+
+    def __init__(self, url="http://127.0.0.1:5000", debugging_port=9222, display=":0",
+                 profile_directory="/home/luna/.config/sleep-dashboard-browser"):
+        self.url = url
+        self.devtools_url = f"http://127.0.0.1:{debugging_port}"
+        self.debugging_port = debugging_port
+        self.display = display
+        self.profile_directory = profile_directory  # Remote debugging needs a non-default profile
+
+    def devtools_request(self, path, method="GET"):
+        req = urllib.request.Request(self.devtools_url + path, method=method)
+        with urllib.request.urlopen(req, timeout=1) as response:
+            body = response.read()
+        return json.loads(body) if body.startswith((b"{", b"[")) else None
+
+    def dashboard_tabs(self):
+        """Dashboard tabs of the running browser, or None if no browser is reachable."""
+        try:
+            targets = self.devtools_request("/json/list")
+        except (urllib.error.URLError, OSError):
+            return None
+        return [target for target in targets if target.get("type") == "page" and target.get("url", "").startswith(self.url)]
+
+    def show(self):
+        stale_tabs = self.dashboard_tabs()
+        if stale_tabs is None:
+            self.launch()
+            return
+        # Open the new tab before closing the old ones, so the window itself never closes
+        self.devtools_request("/json/new?" + urllib.parse.quote(self.url, safe=""), method="PUT")
+        for tab in stale_tabs:
+            self.devtools_request(f"/json/close/{tab['id']}")
+
+    def launch(self):
+        # X11 access only has to be granted for a cold browser launch
+        subprocess.run(['xhost', '+SI:localuser:root'])  # Allow root to access X server
+        env = os.environ.copy()
+        env['DISPLAY'] = self.display
+        subprocess.Popen([
+            'chromium-browser',
+            '--no-sandbox',
+            '--disable-setuid-sandbox',
+            f'--remote-debugging-port={self.debugging_port}',
+            f'--user-data-dir={self.profile_directory}',
+            '--new-window',
+            self.url
+        ], env=env)
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_json(200, self.server.interface.status())
         else:
-            self.display_message("Not Currently", "Monitoring")
-            time.sleep(2)
-            self.show_idle_message()
+            self.send_json(404, {"status": "error", "message": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        interface = self.server.interface
+        if self.path == "/session/start":
+            with interface.control_lock:
+                interface.start_monitoring()
+        elif self.path == "/session/stop":
+            with interface.control_lock:
+                interface.stop_monitoring()
+        else:
+            self.send_json(404, {"status": "error", "message": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, {"status": "success", "monitoring": interface.monitoring})
 
-    def show_idle_message(self):
-        self.display_message("Press Button", "to Start/Stop")
+    def send_json(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-    def schedule_idle_message(self):
-        self.cancel_idle_timer()
-        self.idle_timer = threading.Timer(5.0, self.show_idle_message)
-        self.idle_timer.start()
+    def log_message(self, format, *args):
+        pass  # Keep the console for monitoring output
 
-    def cancel_idle_timer(self):
-        if self.idle_timer:
-            self.idle_timer.cancel()
-            self.idle_timer = None
+class LocalControlServer(threading.Thread):
+    """Loopback-only HTTP endpoint for starting/stopping sessions and reading live status."""
 
-    def cleanup(self):
-        self.cancel_idle_timer()
-        if self.monitoring:
-            self.stop_monitoring()
-        if self.button:
-            self.button.close()
-        if self.lcd:
-            self.display_message("System", "Shutting Down")
-            time.sleep(2)
-            self.lcd.clear()
+    def __init__(self, interface, port=5001):
+        super().__init__(daemon=True)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), ControlRequestHandler)
+        self.httpd.interface = interface
 
-    def is_port_in_use(self, port):
-        """Check if the given port is already in use."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            try:
-                s.bind(('127.0.0.1', port))
-                return False
-            except socket.error:
-                return True
+    def run(self):
+        self.httpd.serve_forever()
 
-    def launch_web_interface(self):
-        try:
-            # Only launch Flask if port 5000 is not in use
-            if not self.is_port_in_use(5000):
-                flask_process = subprocess.Popen(['python3', '/home/luna/Documents/app.py'])
-                # Wait for the server to start
-                time.sleep(2)
-                self.display_message("Flask Server", "Started")
-            else:
-                self.display_message("Flask Server", "Already running")
-            
-            # Set up X11 display access
-            display = ":0"  # Default display
-            subprocess.run(['xhost', '+SI:localuser:root'])  # Allow root to access X server
-            
-            # Set the DISPLAY environment variable
-            env = os.environ.copy()
-            env['DISPLAY'] = display
-            
-            # Open Chromium with necessary environment and flags
-            subprocess.Popen([
-                'chromium-browser',
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--new-window',
-                'http://127.0.0.1:5000'
-            ], env=env)
-            
-            self.display_message("Web Interface", "Launched")
-            time.sleep(2)
-            
-        except Exception as e:
-            print(f"Error launching web interface: {e}")
-            self.display_message("Error Launch", "Web Interface")
-            time.sleep(2)
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 def main():
     log_directory = "/home/luna/Documents/sleep_logs"
+    roi_config_path = "/home/luna/Documents/roi_config.json"  # Bed region and zones for this device
     bus = smbus2.SMBus(1)
     lcd = LCD1602(bus, lines=2, dotsize=0)
-    analyzer = SleepQualityAnalyzer(log_directory=log_directory)
-    control_button = Button(25)
-
-    lcd_interface = LCDButtonInterface(lcd, control_button, analyzer)
+    # Set SLEEP_MONITOR_LOG_FORMAT=binary to save nights in the compact .slog format, and
+    # SLEEP_MONITOR_MAX_EVENTS to change how many events are kept in memory before spilling to disk
+    analyzer = SleepQualityAnalyzer(log_directory=log_directory, log_format=os.environ.get("SLEEP_MONITOR_LOG_FORMAT", "json"),
+                                    max_events_in_memory=int(os.environ.get("SLEEP_MONITOR_MAX_EVENTS", "50000")))
+    control_button = gpiozero.Button(25)
+
+    roi = RegionOfInterest.load(roi_config_path)
+    if roi:
+        print(f"Using bed region from {roi_config_path}")
+
+    # Open and configure the camera once; sessions attach to it while it stays warm
+    camera_service = CameraService()
+    camera_service.open()
+
+    # Set SLEEP_MONITOR_PROFILE=1 to collect per-stage timings (served at /status on the control port)
+    profiling = os.environ.get("SLEEP_MONITOR_PROFILE") == "1"
+
+    # Sample at 2 fps while the sleeper is still and return to full rate when movement starts
+    governor = FrameRateGovernor(min_fps=2, max_fps=30)
+
+    # Keep the dashboard resident so the report can be shown as soon as a session ends
+    dashboard = DashboardServer()
+    dashboard.start()
+
+    # Set SLEEP_HUB_URL (and SLEEP_INGEST_TOKEN) to also send every finished session to the
+    # dashboard of another monitor; SLEEP_DEVICE_ID names this monitor there
+    uploader = None
+    if os.environ.get("SLEEP_HUB_URL"):
+        uploader = SessionUploader(os.environ["SLEEP_HUB_URL"], os.environ.get("SLEEP_DEVICE_ID") or default_device_id(),
+                                   os.environ.get("SLEEP_INGEST_TOKEN", ""), log_directory)
+        uploader.start()
+        uploader.request_upload()  # Catch up on sessions from while the hub was unreachable
+
+    lcd_interface = LCDButtonInterface(lcd, control_button, analyzer, roi=roi, camera_service=camera_service,
+                                       profiling=profiling, governor=governor, dashboard=dashboard,
+                                       uploader=uploader)
+    control_server = LocalControlServer(lcd_interface)
+    control_server.start()
 
     print("Sleep monitoring system ready. Press the button to start/stop monitoring.")
     lcd_interface.show_idle_message()  # Display the initial "Press Button" message
@@ -658,7 +1588,12 @@ def main():
             time.sleep(0.1)
     except KeyboardInterrupt:
         print("Exiting program.")
+        control_server.stop()
         lcd_interface.cleanup()
+        camera_service.shutdown()
+        dashboard.stop()
+        if uploader:
+            uploader.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,177 @@
+# reprocess_night.py
+"""Re-run motion detection over a recorded night and write a standard session log.
+
+The recording (a video file or a frame-dump directory, see pop2.open_frame_source)
+is split into chunks that are processed in parallel. Each worker starts a little
+before its chunk so the running background is settled by the first owned frame,
+and keeps going past the chunk end until any motion it owns has finished. Events
+are owned by the chunk they start in; the stitch step merges whatever still
+overlaps at the boundaries.
+
+The new log goes to reprocessed/ in the log directory by default, so the original
+log and intensity file of the night, which have the same names, are kept.
+
+Usage:
+    python3 reprocess_night.py night_20241102_223000.mp4 --motion-threshold 1500
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import session_format
+from pop2 import MOTION_DETECTORS, RegionOfInterest, create_motion_detector, open_frame_source
+from sleep_analysis import MotionEventTracker, SleepQualityAnalyzer
+
+def process_chunk(path, start_time, fps, first_frame, end_frame, warmup_frames, detector_name, detector_options, cooldown):
+    """Detect motion events that start within frames [first_frame, end_frame).
+
+    Also returns the motion intensity of every frame in that range.
+    """
+    source = open_frame_source(path, start_time=start_time, fps=fps)
+    detector = create_motion_detector(detector_name, **detector_options)
+    tracker = MotionEventTracker(cooldown)
+    owned_from = None
+    owned_until = None
+    events = []
+    timestamps = []
+    intensities = []
+    last_timestamp = None
+
+    index = max(first_frame - warmup_frames, 0)
+    source.seek(index)
+    try:
+        while True:
+            if index >= end_frame and not tracker.motion_ongoing:
+                break
+            frame = source.read()
+            if frame is None:
+                break
+            if index == first_frame:
+                owned_from = frame.timestamp
+            if index == end_frame:
+                owned_until = frame.timestamp
+            last_timestamp = frame.timestamp
+
+            event = tracker.update(detector.detect(frame.image), frame.timestamp)
+            if first_frame <= index < end_frame:
+                timestamps.append(frame.timestamp)
+                intensities.append(detector.motion_fraction)
+            if event and owned_from is not None and (owned_until is None or event[0] < owned_until):
+                if event[0] >= owned_from:
+                    events.append(event)
+            index += 1
+    finally:
+        source.close()
+    return events, last_timestamp, np.array(timestamps), np.array(intensities)
+
+def stitch_events(chunk_events):
+    """Merge per-chunk events into one sorted list, joining any that overlap."""
+    merged = []
+    for start, end in sorted(event for events in chunk_events for event in events):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+def load_sound_peaks(log_path):
+    """Carry sound peaks over from the original session log of the same night."""
+    data = session_format.read_log(log_path)
+    return [datetime.fromisoformat(peak) for peak in data.get('sound_peaks', [])]
+
+def existing_outputs(directory, start_time):
+    """Session logs and intensity files in directory that a session starting at start_time would replace."""
+    if not os.path.isdir(directory):
+        return []
+    stamp = start_time.strftime("%Y%m%d_%H%M%S")
+    return sorted(filename for filename in os.listdir(directory)
+                  if filename == f"sleep_intensity_{stamp}.bin"
+                  or (session_format.is_session_log(filename) and filename.startswith(f"sleep_log_{stamp}_to_")))
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess a recorded night with new motion detection settings.")
+    parser.add_argument('recording', help="Video file or frame-dump directory")
+    parser.add_argument('--start', type=datetime.fromisoformat, default=None,
+                        help="Wall-clock time of the first frame (default: parsed from the file name)")
+    parser.add_argument('--fps', type=float, default=None, help="Override the recording frame rate")
+    parser.add_argument('--detector', default='contour', choices=list(MOTION_DETECTORS))
+    parser.add_argument('--motion-threshold', type=float, default=1000)
+    parser.add_argument('--pixel-threshold', type=int, default=40)
+    parser.add_argument('--cooldown', type=float, default=3)
+    parser.add_argument('--chunk-seconds', type=float, default=600)
+    parser.add_argument('--overlap-seconds', type=float, default=10,
+                        help="Frames processed before each chunk to settle the background model")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--roi', default=None, help="Bed region config (crop/polygon) to restrict detection to")
+    parser.add_argument('--sound-log', default=None, help="Original session log to take sound peaks from")
+    parser.add_argument('--log-directory', default="/home/luna/Documents/sleep_logs")
+    parser.add_argument('--output-directory', default=None,
+                        help="Where to write the new log (default: reprocessed/ in the log directory)")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="Replace a log of the same night already in the output directory")
+    parser.add_argument('--log-format', default='json', choices=['json', 'binary'],
+                        help="Session log format; binary writes the compact .slog format")
+    args = parser.parse_args()
+
+    output_directory = args.output_directory or os.path.join(args.log_directory, "reprocessed")
+
+    try:
+        source = open_frame_source(args.recording, start_time=args.start, fps=args.fps)
+    except ValueError as e:
+        sys.exit(str(e))
+    frame_count = source.frame_count
+    fps = source.fps
+    first_frame = source.read()
+    source.close()
+    if first_frame is None:
+        sys.exit(f"No frames could be read from {args.recording}")
+    first_timestamp = first_frame.timestamp
+
+    existing = existing_outputs(output_directory, datetime.fromtimestamp(first_timestamp))
+    if existing and not args.overwrite:
+        sys.exit(f"{output_directory} already has {', '.join(existing)}; "
+                 f"pass --overwrite or choose another --output-directory")
+
+    chunk_frames = max(int(args.chunk_seconds * fps), 1)
+    warmup_frames = int(args.overlap_seconds * fps)
+    detector_options = {"motion_threshold": args.motion_threshold, "pixel_threshold": args.pixel_threshold}
+    if args.roi:
+        detector_options["roi"] = RegionOfInterest.load(args.roi)
+    chunks = [(first, min(first + chunk_frames, frame_count)) for first in range(0, frame_count, chunk_frames)]
+    print(f"Reprocessing {frame_count} frames in {len(chunks)} chunks on {args.workers} workers")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(process_chunk, args.recording, args.start, args.fps, first, end, warmup_frames,
+                            args.detector, detector_options, args.cooldown)
+            for first, end in chunks
+        ]
+        results = [future.result() for future in futures]
+
+    events = stitch_events(result[0] for result in results)
+    last_timestamp = max(result[1] for result in results if result[1] is not None)
+
+    for filename in existing:
+        # A log of another format or end time would otherwise list the night twice
+        os.remove(os.path.join(output_directory, filename))
+    analyzer = SleepQualityAnalyzer(log_directory=output_directory, log_format=args.log_format)
+    analyzer.start_monitoring(start_time=datetime.fromtimestamp(first_timestamp))
+    for _, _, timestamps, intensities in results:
+        analyzer.intensity_recorder.extend(timestamps, intensities)
+    for start, end in events:
+        analyzer.log_motion_event(datetime.fromtimestamp(start), datetime.fromtimestamp(end))
+    if args.sound_log:
+        for peak in load_sound_peaks(args.sound_log):
+            analyzer.log_sound_peak(peak)
+    analyzer.stop_monitoring(end_time=datetime.fromtimestamp(last_timestamp))
+
+    log_file, report = analyzer.finalize_session()
+    print(f"Found {len(events)} motion events, sleep score {report['sleep_score']}")
+    print(f"Session log written to {log_file}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# session_archive.py
+"""Monthly archives of old session logs, and the compaction job that writes them.
+
+Nights older than a cut-off are moved out of the hot log directory into one
+compressed archive per month (`archive/sleep_archive_YYYYMM.npz`). Inside an archive
+the bulky per-event data is stored column-wise: event times become integer
+microsecond offsets from the session start, delta-encoded so they compress well,
+and the motion intensity series is stored the same way. Everything else in a log
+stays as JSON. `archive/index.json` keeps a short summary of every archived
+session, so listings never have to open an archive.
+
+Usage:
+    python3 session_archive.py --max-age-days 30
+"""
+import argparse
+import io
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import session_format
+from session_format import delta_encode, offsets_us
+from sleep_analysis import INTENSITY_DTYPE, episodes_from_log, write_file_atomically, write_json_atomically
+
+ARCHIVE_DIRECTORY = "archive"
+INDEX_FILE = "index.json"
+LOG_NAME = re.compile(r"sleep_log_(\d{8}_\d{6})_to_(\d{8}_\d{6})\.")
+
+def summarize_session(log_data):
+    """The part of a session log the dashboard lists sessions by."""
+    report = log_data.get("sleep_report", {})
+    if isinstance(report, dict) and report and "snoring_episodes" not in report:
+        # Logs saved before episodes were reported get them from their events
+        report = dict(report, **episodes_from_log(log_data))
+    return {
+        "start_time": log_data.get("start_time"),
+        "end_time": log_data.get("end_time"),
+        "sleep_report": report,
+        "motion_event_count": len(log_data.get("motion_events", [])),
+        "sound_peak_count": len(log_data.get("sound_peaks", []))
+    }
+
+def archive_name(start_time):
+    return f"sleep_archive_{start_time.strftime('%Y%m')}.npz"
+
+def encode_archive(sessions):
+    """Columns for a list of (log file name, log data, intensity records) sessions."""
+    meta = []
+    columns = {name: [] for name in ("motion_start", "motion_length", "sound", "intensity_time", "intensity_value")}
+    counts = {name: [0] for name in ("motion", "sound", "intensity")}
+    for log_file, log_data, intensity in sessions:
+        start = datetime.fromisoformat(log_data["start_time"])
+        events = log_data.get("motion_events", [])
+        start_us = np.datetime64(log_data["start_time"], "us")
+        event_starts = offsets_us([event["start"] for event in events], start_us)
+        event_ends = offsets_us([event["end"] for event in events], start_us)
+        peaks = offsets_us(log_data.get("sound_peaks", []), start_us)
+        columns["motion_start"].append(delta_encode(event_starts))
+        columns["motion_length"].append(event_ends - event_starts)
+        columns["sound"].append(delta_encode(peaks))
+        counts["motion"].append(len(events))
+        counts["sound"].append(len(peaks))
+
+        intensity_times = np.round((intensity["timestamp"] - start.timestamp()) * 1e6).astype(np.int64)
+        columns["intensity_time"].append(delta_encode(intensity_times))
+        columns["intensity_value"].append(intensity["intensity"])
+        counts["intensity"].append(len(intensity))
+
+        rest = {key: value for key, value in log_data.items() if key not in ("motion_events", "sound_peaks")}
+        meta.append({"log_file": log_file, "log": rest})
+
+    arrays = {name: np.concatenate(parts) if parts else np.empty(0) for name, parts in columns.items()}
+    arrays["intensity_value"] = arrays["intensity_value"].astype(np.float32)
+    for name, values in counts.items():
+        arrays[f"{name}_offsets"] = np.cumsum(values, dtype=np.int64)
+    arrays["sessions"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    return arrays
+
+class Archive:
+    """One monthly archive.
+
+    A column is decompressed when it is first used, so reading a night's events
+    never inflates the month's intensity series, by far the largest columns.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.arrays = {}
+        self.sessions = json.loads(self.array("sessions").tobytes())
+        self.positions = {session["log_file"]: i for i, session in enumerate(self.sessions)}
+
+    def array(self, name):
+        if name not in self.arrays:
+            with np.load(self.path) as data:
+                self.arrays[name] = data[name]
+        return self.arrays[name]
+
+    def column(self, name, offsets, i):
+        start, end = self.array(f"{offsets}_offsets")[i:i + 2]
+        return self.array(name)[start:end]
+
+    def load_session(self, log_file):
+        """The session's log exactly as it was in its JSON file."""
+        i = self.positions[log_file]
+        log_data = dict(self.sessions[i]["log"])
+        start = datetime.fromisoformat(log_data["start_time"])
+        event_starts = np.cumsum(self.column("motion_start", "motion", i))
+        event_ends = event_starts + self.column("motion_length", "motion", i)
+        motion_events = []
+        for event_start, event_end in zip(event_starts.tolist(), event_ends.tolist()):
+            event_start = start + timedelta(microseconds=event_start)
+            event_end = start + timedelta(microseconds=event_end)
+            motion_events.append({"start": event_start.isoformat(), "end": event_end.isoformat(),
+                                  "duration": (event_end - event_start).total_seconds()})
+        peaks = np.cumsum(self.column("sound", "sound", i)).tolist()
+        log_data["motion_events"] = motion_events
+        log_data["sound_peaks"] = [(start + timedelta(microseconds=peak)).isoformat() for peak in peaks]
+        return log_data
+
+    def load_intensity(self, log_file):
+        i = self.positions[log_file]
+        start = datetime.fromisoformat(self.sessions[i]["log"]["start_time"])
+        times = np.cumsum(self.column("intensity_time", "intensity", i))
+        records = np.empty(len(times), dtype=INTENSITY_DTYPE)
+        records["timestamp"] = start.timestamp() + times / 1e6
+        records["intensity"] = self.column("intensity_value", "intensity", i)
+        return records
+
+    def all_sessions(self):
+        for session in self.sessions:
+            log_file = session["log_file"]
+            yield log_file, self.load_session(log_file), self.load_intensity(log_file)
+
+def write_archive(path, sessions):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **encode_archive(sessions))
+    write_file_atomically(path, buffer.getvalue())
+
+def load_index(log_directory):
+    """Summaries of all archived sessions, keyed by log file name, each naming its archive."""
+    path = os.path.join(log_directory, ARCHIVE_DIRECTORY, INDEX_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def find_archive(log_directory, log_file):
+    """The Archive holding log_file, or None if it was never archived."""
+    entry = load_index(log_directory).get(log_file)
+    if entry is None:
+        return None
+    return Archive(os.path.join(log_directory, ARCHIVE_DIRECTORY, entry["archive"]))
+
+def read_hot_session(log_directory, log_file):
+    log_data = session_format.read_log(os.path.join(log_directory, log_file))
+    intensity = np.empty(0, dtype=INTENSITY_DTYPE)
+    intensity_file = log_data.get("motion_intensity_file")
+    if intensity_file and os.path.exists(os.path.join(log_directory, intensity_file)):
+        intensity = np.fromfile(os.path.join(log_directory, intensity_file), dtype=INTENSITY_DTYPE)
+    return log_data, intensity
+
+def session_times(log_directory, log_file):
+    """(start, end) of a hot session: from its file name, or from its log if the name does not tell."""
+    match = LOG_NAME.match(log_file)
+    if match:
+        return tuple(datetime.strptime(time, "%Y%m%d_%H%M%S") for time in match.groups())
+    path = os.path.join(log_directory, log_file)
+    log_data = session_format.read_header(path) if log_file.endswith(".slog") else session_format.read_log(path)
+    if not log_data.get("start_time"):
+        return None
+    start = datetime.fromisoformat(log_data["start_time"])
+    return start, datetime.fromisoformat(log_data["end_time"]) if log_data.get("end_time") else start
+
+def compact(log_directory, max_age_days=30, now=None, dry_run=False):
+    """Move sessions that ended more than max_age_days ago into their monthly archives.
+
+    Which sessions move where is decided from the file names; the sessions are then
+    read, archived and removed one month at a time, so only one month is ever in
+    memory.
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=max_age_days)
+    archive_directory = os.path.join(log_directory, ARCHIVE_DIRECTORY)
+    by_month = {}
+    for log_file in sorted(os.listdir(log_directory)):
+        if not session_format.is_session_log(log_file):
+            continue
+        try:
+            times = session_times(log_directory, log_file)
+        except (ValueError, OSError) as e:
+            print(f"Skipping {log_file}: {e}")
+            continue
+        if times is not None and times[1] <= cutoff:
+            by_month.setdefault(archive_name(times[0]), []).append(log_file)
+
+    if dry_run or not by_month:
+        return {month: len(log_files) for month, log_files in by_month.items()}
+
+    os.makedirs(archive_directory, exist_ok=True)
+    index = load_index(log_directory)
+    archived = {}
+    for month, log_files in sorted(by_month.items()):
+        sessions = []
+        for log_file in log_files:
+            try:
+                log_data, intensity = read_hot_session(log_directory, log_file)
+            except (ValueError, OSError) as e:
+                print(f"Skipping {log_file}: {e}")
+                continue
+            sessions.append((log_file, log_data, intensity))
+        if not sessions:
+            continue
+
+        path = os.path.join(archive_directory, month)
+        new_files = {log_file for log_file, _, _ in sessions}
+        # Re-archiving after an interrupted run replaces the earlier copy of a session
+        existing = [session for session in Archive(path).all_sessions() if session[0] not in new_files] if os.path.exists(path) else []
+        merged = sorted(existing + sessions, key=lambda session: session[1]["start_time"])
+        write_archive(path, merged)
+        for log_file, log_data, _ in sessions:
+            index[log_file] = dict(summarize_session(log_data), archive=month)
+        write_json_atomically(os.path.join(archive_directory, INDEX_FILE), index)
+
+        # Hot files go only once the archive and the index that points at it are on disk
+        for log_file, log_data, _ in sessions:
+            os.remove(os.path.join(log_directory, log_file))
+            intensity_file = log_data.get("motion_intensity_file")
+            if intensity_file and os.path.exists(os.path.join(log_directory, intensity_file)):
+                os.remove(os.path.join(log_directory, intensity_file))
+        archived[month] = len(sessions)
+    return archived
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old sleep sessions into compressed monthly archives.")
+    parser.add_argument('--log-directory', default="/home/luna/Documents/sleep_logs")
+    parser.add_argument('--max-age-days', type=float, default=30, help="Keep sessions newer than this as plain files")
+    parser.add_argument('--dry-run', action='store_true', help="Only list what would be archived")
+    args = parser.parse_args()
+
+    archived = compact(args.log_directory, args.max_age_days, dry_run=args.dry_run)
+    if not archived:
+        print("Nothing to archive.")
+    for month, count in sorted(archived.items()):
+        print(f"{'Would archive' if args.dry_run else 'Archived'} {count} session(s) into {month}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# session_cache.py
+"""In-memory, column-wise summaries of every session, hot or archived, for the dashboard.
+
+Each session is read once, when it first shows up in the log directory or the
+archive index; after that, questions about the whole history are answered with
+vectorized NumPy operations on the columns instead of by re-reading files.
+"""
+import bisect
+import json
+import os
+import threading
+
+import numpy as np
+
+import session_archive
+import session_format
+
+# Nights are grouped by the evening they start on, so a session started after midnight
+# still counts towards the day before
+NIGHT_OFFSET = np.timedelta64(12, "h")
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def parse_number(value, suffix=""):
+    """Report fields such as "7.52 hours" or "12.50%" as floats."""
+    if isinstance(value, str):
+        value = value.strip().removesuffix(suffix).strip()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def summary_row(summary):
+    report = summary.get("sleep_report")
+    report = report if isinstance(report, dict) else {}
+    return (
+        np.datetime64(summary["start_time"], "s"),
+        parse_number(report.get("sleep_score")),
+        parse_number(report.get("motion_percentage"), "%"),
+        parse_number(report.get("sound_peaks_per_hour")),
+        parse_number(report.get("monitoring_duration"), "hours"),
+        summary.get("motion_event_count", 0),
+        summary.get("sound_peak_count", 0)
+    )
+
+class SessionCache:
+    """Summary columns for all sessions in a log directory, sorted by start time.
+
+    Call refresh() before reading the columns; it only reads sessions that are new
+    or whose file changed (a re-uploaded night, for example) and drops ones that are gone.
+    """
+
+    COLUMNS = ("start", "score", "motion_percentage", "sound_peaks_per_hour", "duration_hours",
+               "motion_events", "sound_peaks")
+    # Report metrics that describe what kind of night it was, for finding similar nights
+    FEATURES = ("score", "motion_percentage", "sound_peaks_per_hour", "duration_hours")
+
+    def __init__(self, log_directory):
+        self.log_directory = log_directory
+        self.rows = {}  # log file -> summary row
+        self.stamps = {}  # log file -> (mtime, size) of a hot file, or its archive index entry
+        self.index_mtime = None
+        self.archived = {}
+        self.lock = threading.Lock()
+        self.log_files = np.empty(0, dtype=object)
+        self.columns = {}
+        self.positions = {}
+        self.features = np.empty((0, len(self.FEATURES)))
+        self.sorted_scores = []  # Kept sorted as sessions come and go, for bisect lookups
+        self.build_columns()
+
+    def read_summary(self, log_file):
+        path = os.path.join(self.log_directory, log_file)
+        if log_file.endswith(".slog"):
+            return session_format.read_header(path)
+        with open(path, 'r') as f:
+            return session_archive.summarize_session(json.load(f))
+
+    def refresh(self):
+        with self.lock:
+            index_path = os.path.join(self.log_directory, session_archive.ARCHIVE_DIRECTORY, session_archive.INDEX_FILE)
+            index_mtime = os.path.getmtime(index_path) if os.path.exists(index_path) else None
+            if index_mtime != self.index_mtime:
+                self.archived = session_archive.load_index(self.log_directory)
+                self.index_mtime = index_mtime
+
+            hot = set()
+            changed = False
+            for log_file in os.listdir(self.log_directory):
+                if not session_format.is_session_log(log_file):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.log_directory, log_file))
+                except OSError:
+                    continue
+                hot.add(log_file)
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if self.stamps.get(log_file) == stamp:
+                    continue
+                try:
+                    self.replace_row(log_file, summary_row(self.read_summary(log_file)), stamp)
+                    changed = True
+                except (ValueError, KeyError, OSError) as e:
+                    print(f"Error processing file {log_file}: {e}")
+            for log_file, entry in self.archived.items():
+                if log_file not in hot and self.stamps.get(log_file) != entry:
+                    self.replace_row(log_file, summary_row(entry), entry)
+                    changed = True
+            for log_file in self.rows.keys() - hot - self.archived.keys():
+                self.remove_row(log_file)
+                changed = True
+            if changed:
+                self.build_columns()
+            return self.log_files, self.columns
+
+    def replace_row(self, log_file, row, stamp):
+        if log_file in self.rows:
+            self.remove_row(log_file)
+        self.rows[log_file] = row
+        self.stamps[log_file] = stamp
+        if not np.isnan(row[1]):
+            bisect.insort(self.sorted_scores, row[1])
+
+    def remove_row(self, log_file):
+        self.stamps.pop(log_file, None)
+        score = self.rows.pop(log_file)[1]
+        if not np.isnan(score):
+            del self.sorted_scores[bisect.bisect_left(self.sorted_scores, score)]
+
+    def build_columns(self):
+        log_files = sorted(self.rows, key=lambda log_file: self.rows[log_file][0])
+        rows = [self.rows[log_file] for log_file in log_files]
+        dtypes = ("datetime64[s]", np.float64, np.float64, np.float64, np.float64, np.int64, np.int64)
+        # Readers keep using the previous arrays until these replace them
+        self.columns = {
+            name: np.array([row[i] for row in rows], dtype=dtype)
+            for i, (name, dtype) in enumerate(zip(self.COLUMNS, dtypes))
+        }
+        self.log_files = np.array(log_files, dtype=object)
+        self.positions = {log_file: i for i, log_file in enumerate(log_files)}
+
+        # Each metric scaled to zero mean and unit variance, so none dominates the distance;
+        # a missing metric sits at the mean and so does not count either way
+        features = np.column_stack([self.columns[name] for name in self.FEATURES]) if rows else self.features[:0]
+        with np.errstate(invalid="ignore"):
+            means = np.nanmean(features, axis=0) if rows else 0
+            deviations = np.nanstd(features, axis=0) if rows else 1
+        deviations = np.where(np.isnan(deviations) | (deviations == 0), 1, deviations)
+        self.features = np.nan_to_num((features - means) / deviations)
+
+    def top_percent(self, score):
+        """Share of all nights, in percent, that scored at least as well as score."""
+        with self.lock:
+            if not self.sorted_scores:
+                return None
+            at_least = len(self.sorted_scores) - bisect.bisect_left(self.sorted_scores, score)
+            return at_least / len(self.sorted_scores) * 100
+
+    def similar(self, log_file, k=5):
+        """The k nights closest to log_file in normalized report metrics, as (log file, distance)."""
+        with self.lock:
+            i = self.positions.get(log_file)
+            if i is None:
+                return None
+            distances = np.sqrt(((self.features - self.features[i]) ** 2).sum(axis=1))
+            distances[i] = np.inf
+            k = min(k, len(distances) - 1)
+            if k <= 0:
+                return []
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest])]
+            return [(self.log_files[j], float(distances[j])) for j in nearest]
+
+def night_groups(starts, group):
+    """Group key and label of every session for grouping by "week", "month" or "weekday"."""
+    nights = (starts - NIGHT_OFFSET).astype("datetime64[D]")
+    # 1970-01-01 was a Thursday
+    weekdays = (nights.astype(np.int64) + 3) % 7
+    if group == "weekday":
+        return weekdays, np.array(WEEKDAYS, dtype=object)[weekdays]
+    if group == "week":
+        week_starts = nights - weekdays.astype("timedelta64[D]")
+        return week_starts.astype(np.int64), week_starts.astype(str)
+    if group == "month":
+        months = nights.astype("datetime64[M]")
+        return months.astype(np.int64), months.astype(str)
+    raise ValueError(f"Unknown group {group!r}; use week, month or weekday")
+
+def grouped_trends(columns, group, since=None):
+    """Per-group night counts and score/motion/sound statistics, oldest group first."""
+    starts = columns["start"]
+    selected = starts >= since if since is not None else np.ones(len(starts), dtype=bool)
+    starts = starts[selected]
+    if len(starts) == 0:
+        return []
+    keys, labels = night_groups(starts, group)
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    counts = np.bincount(inverse)
+
+    def group_mean(values):
+        valid = ~np.isnan(values)
+        totals = np.bincount(inverse[valid], weights=values[valid], minlength=len(unique_keys))
+        numbers = np.bincount(inverse[valid], minlength=len(unique_keys))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return totals / numbers
+
+    scores = columns["score"][selected]
+    order = np.argsort(inverse, kind="stable")
+    boundaries = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sorted_scores = scores[order]
+    score_min = np.fmin.reduceat(sorted_scores, boundaries)
+    score_max = np.fmax.reduceat(sorted_scores, boundaries)
+    score_mean = group_mean(scores)
+    motion_mean = group_mean(columns["motion_percentage"][selected])
+    sound_mean = group_mean(columns["sound_peaks_per_hour"][selected])
+    duration_mean = group_mean(columns["duration_hours"][selected])
+
+    def number(value):
+        return None if np.isnan(value) else round(float(value), 2)
+
+    return [
+        {
+            "group": str(labels[first[i]]),
+            "nights": int(counts[i]),
+            "score_mean": number(score_mean[i]),
+            "score_min": number(score_min[i]),
+            "score_max": number(score_max[i]),
+            "motion_percentage_mean": number(motion_mean[i]),
+            "sound_peaks_per_hour_mean": number(sound_mean[i]),
+            "duration_hours_mean": number(duration_mean[i])
+        }
+        for i in range(len(unique_keys))
+    ]
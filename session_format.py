@@ -0,0 +1,235 @@
+# session_format.py
+"""Compact binary session logs (`sleep_log_*.slog`), an alternative to the JSON logs.
+
+Layout, all little-endian:
+
+    4s   magic b"SLOG"
+    B    format version
+    3x   padding
+    I    header length in bytes
+    ...  header: the log as UTF-8 JSON, minus motion_events and sound_peaks, plus
+         motion_event_count and sound_peak_count
+    ...  varints: motion event starts, then motion event durations, then sound peaks
+
+Every time is in microseconds; starts and peaks are delta-encoded from the session
+start and zigzag-encoded, so they are small non-negative numbers. All of them are
+stored as LEB128 varints, 7 bits per byte, which takes a typical gap between two
+events (seconds to minutes) down to 3 or 4 bytes.
+
+Times are kept to the microsecond like the JSON logs and the archives, and 64-bit
+values cannot overflow however long a session runs. Older files with fixed-width
+columns are still read: version 1 stored 32-bit milliseconds (so it could not
+hold sessions longer than about 24 days), version 2 64-bit microseconds. The
+report and counts sit in the header, so listing a session only reads that.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"SLOG"
+VERSION = 3
+PREAMBLE = struct.Struct("<4sB3xI")
+# Fixed-width versions: dtypes of the offset and duration columns, and their unit
+COLUMNS = {1: ("<i4", "<u4", "ms"), 2: ("<i8", "<u8", "us")}
+# ISO timestamps are assembled byte-wise from this template (see iso_strings)
+ISO_TEMPLATE = np.frombuffer(b"0000-00-00T00:00:00.000000,", dtype=np.uint8)
+ISO_TENS = [11, 14, 17, 20, 22, 24]
+LOG_EXTENSIONS = (".json", ".slog")
+
+def is_session_log(filename):
+    """True for finished session logs in either format (partial .tmp files never match)."""
+    return filename.startswith("sleep_log_") and filename.endswith(LOG_EXTENSIONS)
+
+def offsets_us(times, start):
+    """ISO timestamps or datetime64 values as microseconds since start."""
+    return (np.array(times, dtype="datetime64[us]") - start).astype(np.int64)
+
+def delta_encode(values):
+    return np.diff(np.asarray(values, dtype=np.int64), prepend=0).astype("<i8")
+
+def zigzag(values):
+    """Signed int64 values as uint64, small magnitudes of either sign staying small."""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+def unzigzag(values):
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+def encode_varints(values):
+    """uint64 values as LEB128: 7 bits per byte, low bits first, high bit set on all but the last byte."""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for bits in range(7, 64, 7):
+        lengths += values >= np.uint64(1 << bits)
+    ends = np.cumsum(lengths)
+    owner = np.repeat(np.arange(len(values)), lengths)
+    shifts = (np.arange(len(owner)) - np.repeat(ends - lengths, lengths)) * 7
+    data = ((values[owner] >> shifts.astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8) | np.uint8(0x80)
+    data[ends - 1] &= np.uint8(0x7f)
+    return data.tobytes()
+
+def decode_varints(data, count):
+    """The first `count` LEB128 values in a uint8 array, as uint64."""
+    ends = np.flatnonzero(data < 0x80)[:count] + 1
+    if len(ends) < count:
+        raise ValueError(f"expected {count} values, found {len(ends)}")
+    if not count:
+        return np.empty(0, dtype=np.uint64)
+    starts = np.concatenate([[0], ends[:-1]])
+    lengths = ends - starts
+    shifts = (np.arange(ends[-1]) - np.repeat(starts, lengths)) * 7
+    parts = (data[:ends[-1]] & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+def iso_strings(times):
+    """datetime64 values as ISO strings with microseconds, like np.datetime_as_string but several times faster.
+
+    The characters of all timestamps are filled in as one byte array and split
+    into strings in a single step, rather than formatted one value at a time.
+    """
+    times = np.asarray(times, dtype="datetime64[us]")
+    if not len(times):
+        return []
+    days = times.astype("datetime64[D]")
+    first = days.min()
+    # A session spans a handful of days, each formatted once
+    calendar = np.frombuffer("".join(np.datetime_as_string(np.arange(first, days.max() + 1))).encode(), dtype="S10")
+    text = np.empty((len(times), len(ISO_TEMPLATE)), dtype=np.uint8)
+    text[:] = ISO_TEMPLATE
+    text[:, :10] = calendar[(days - first).astype(np.int64)].view(np.uint8).reshape(-1, 10)
+    microseconds = (times - days).astype(np.int64)
+    seconds = (microseconds // 1000000).astype(np.int32)
+    fraction = (microseconds % 1000000).astype(np.int32)
+    # Two digits each: hours, minutes, seconds and three pairs of fraction digits
+    pairs = np.empty((len(times), 6), dtype=np.uint8)
+    pairs[:, 0] = seconds // 3600
+    pairs[:, 1] = seconds // 60 % 60
+    pairs[:, 2] = seconds % 60
+    pairs[:, 3] = fraction // 10000
+    pairs[:, 4] = fraction // 100 % 100
+    pairs[:, 5] = fraction % 100
+    text[:, ISO_TENS] = pairs // 10 + ord("0")
+    text[:, [column + 1 for column in ISO_TENS]] = pairs % 10 + ord("0")
+    return text.tobytes().decode("ascii")[:-1].split(",")
+
+def encode_session(log_data):
+    """The bytes of a .slog file for a log in the JSON layout."""
+    events = log_data.get("motion_events", [])
+    header = {key: value for key, value in log_data.items() if key not in ("motion_events", "sound_peaks")}
+    return encode_arrays(header, [event["start"] for event in events], [event["end"] for event in events],
+                         log_data.get("sound_peaks", []))
+
+def encode_arrays(header, event_starts, event_ends, peaks):
+    """The bytes of a .slog file for a log without its events plus the event times.
+
+    The times may be ISO strings or datetime64 arrays, so a session kept as arrays
+    never has to be expanded into one object per event.
+    """
+    return b"".join(encode_chunks(header, len(event_starts), len(peaks),
+                                  lambda: [(event_starts, event_ends)], lambda: [peaks]))
+
+def encode_chunks(header, motion_count, peak_count, motion_segments, peak_segments, dump_header=None):
+    """encode_arrays for events that come in segments, as chunks of bytes.
+
+    motion_segments() yields (starts, ends) pairs and peak_segments() arrays of
+    peaks, in time order; the motion segments are read twice, once per column.
+    Only one segment is in memory at a time. The counts go into the header before
+    any segment is read, so they are checked against what was actually written.
+
+    dump_header(header) returns the header's compact JSON as chunks of bytes, by
+    default json.dumps in one chunk. It is called twice, first to measure the
+    header, so a header with long lists (see sleep_analysis.json_chunks) is
+    streamed as well.
+    """
+    start = np.datetime64(header["start_time"], "us")
+    header = dict(header)
+    header["motion_event_count"] = motion_count
+    header["sound_peak_count"] = peak_count
+    if dump_header is None:
+        dump_header = lambda header: [json.dumps(header, separators=(",", ":")).encode()]
+    yield PREAMBLE.pack(MAGIC, VERSION, sum(len(chunk) for chunk in dump_header(header)))
+    yield from dump_header(header)
+
+    def deltas(segments, count, name):
+        # Each segment continues the delta encoding where the previous one stopped
+        previous = written = 0
+        for times in segments:
+            offsets = offsets_us(times, start)
+            if len(offsets):
+                yield encode_varints(zigzag(delta_encode(offsets - previous)))
+                previous = offsets[-1]
+                written += len(offsets)
+        if written != count:
+            raise ValueError(f"{written} {name} written, {count} declared")
+
+    yield from deltas((starts for starts, _ in motion_segments()), motion_count, "motion events")
+    for starts, ends in motion_segments():
+        yield encode_varints(offsets_us(ends, start) - offsets_us(starts, start))
+    yield from deltas(peak_segments(), peak_count, "sound peaks")
+
+def parse_preamble(data, path):
+    magic, version, header_length = PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a binary session log")
+    if version != VERSION and version not in COLUMNS:
+        raise ValueError(f"{path} has unsupported session log version {version}")
+    return version, header_length
+
+def read_header(path):
+    """The header of a .slog file: everything but the event arrays, with their counts."""
+    with open(path, 'rb') as f:
+        _, header_length = parse_preamble(f.read(PREAMBLE.size), path)
+        return json.loads(f.read(header_length))
+
+def read_arrays(path):
+    """The header plus event arrays as numpy datetime64[us] values.
+
+    Returns (header, motion starts, motion ends, sound peaks).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    version, header_length = parse_preamble(data, path)
+    header = json.loads(data[PREAMBLE.size:PREAMBLE.size + header_length])
+    motion_count = header["motion_event_count"]
+    offset = PREAMBLE.size + header_length
+    start = np.datetime64(header["start_time"], "us")
+    if version == VERSION:
+        try:
+            values = decode_varints(np.frombuffer(data, dtype=np.uint8, offset=offset),
+                                    2 * motion_count + header["sound_peak_count"])
+        except ValueError as e:
+            raise ValueError(f"{path} is truncated: {e}")
+        starts = start + np.cumsum(unzigzag(values[:motion_count])).astype("timedelta64[us]")
+        ends = starts + values[motion_count:2 * motion_count].view(np.int64).astype("timedelta64[us]")
+        peak_times = start + np.cumsum(unzigzag(values[2 * motion_count:])).astype("timedelta64[us]")
+        return header, starts, ends, peak_times
+
+    offset_dtype, length_dtype, unit = COLUMNS[version]
+    event_starts = np.frombuffer(data, dtype=offset_dtype, count=motion_count, offset=offset)
+    offset += event_starts.nbytes
+    event_lengths = np.frombuffer(data, dtype=length_dtype, count=motion_count, offset=offset)
+    offset += event_lengths.nbytes
+    peaks = np.frombuffer(data, dtype=offset_dtype, count=header["sound_peak_count"], offset=offset)
+    starts = start + np.cumsum(event_starts, dtype=np.int64).astype(f"timedelta64[{unit}]")
+    ends = starts + event_lengths.astype(np.int64).astype(f"timedelta64[{unit}]")
+    peak_times = start + np.cumsum(peaks, dtype=np.int64).astype(f"timedelta64[{unit}]")
+    return header, starts, ends, peak_times
+
+def read_log(path):
+    """A session log in the JSON layout, whichever format it was saved in."""
+    if not path.endswith(".slog"):
+        with open(path, 'r') as f:
+            return json.load(f)
+    header, starts, ends, peaks = read_arrays(path)
+    log_data = {key: value for key, value in header.items() if key not in ("motion_event_count", "sound_peak_count")}
+    durations = (ends - starts) / np.timedelta64(1, "s")
+    # One pass formats every time of the session
+    times = iso_strings(np.concatenate([starts, ends, peaks]))
+    count = len(starts)
+    log_data["motion_events"] = [
+        {"start": start, "end": end, "duration": duration}
+        for start, end, duration in zip(times[:count], times[count:2 * count], durations.tolist())
+    ]
+    log_data["sound_peaks"] = times[2 * count:]
+    return log_data
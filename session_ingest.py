@@ -0,0 +1,329 @@
+# session_ingest.py
+"""Session uploads from other monitors, so one dashboard can serve every bedroom.
+
+A monitor POSTs a gzip-compressed JSON batch of finished sessions to /api/ingest:
+
+    {"device_id": "bedroom-2",
+     "sessions": [{"log_file": "sleep_log_..._to_....json", "log": {...}}, ...]}
+
+Each device gets its own log directory, `devices/<device id>/`, laid out like the
+local one, so the session cache, the archive and the dashboard work on it unchanged.
+Uploads are idempotent: a session is stored under its log file name and only
+rewritten when its content changed, so a monitor can simply resend a batch after a
+timeout.
+
+Monitors send their sessions with a SessionUploader, authenticated by a shared
+token (SLEEP_INGEST_TOKEN on both sides).
+
+Request handlers never touch the disk themselves. They hand their sessions to the
+IngestWriter thread, which commits whatever has queued up in one go: every log of a
+batch is written and synced, then the device's manifest of content hashes is
+replaced, with one directory sync per device instead of one per file.
+"""
+import gzip
+import hashlib
+import json
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+import session_format
+from sleep_analysis import sync_directory_entries, write_file_atomically, write_json_atomically
+
+DEVICES_DIRECTORY = "devices"
+MANIFEST_FILE = "ingest.json"  # log file -> content hash of every uploaded session of a device
+DEVICE_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+MAX_BATCH_BYTES = 32 * 1024 * 1024  # Decompressed; bounds the work a single request can cause
+MAX_BATCH_SESSIONS = 200
+UPLOAD_STATE_FILE = "uploaded.json"  # Log files a monitor's hub has accepted
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024  # Uncompressed JSON per upload, well inside the hub's limits
+
+def device_directory(log_directory, device_id):
+    """Log directory of an uploading device; raises ValueError for a malformed device id."""
+    if not isinstance(device_id, str) or not DEVICE_ID.fullmatch(device_id):
+        raise ValueError("device_id must be 1-64 letters, digits, '-' or '_'")
+    return os.path.join(log_directory, DEVICES_DIRECTORY, device_id)
+
+def list_devices(log_directory):
+    directory = os.path.join(log_directory, DEVICES_DIRECTORY)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if DEVICE_ID.fullmatch(name) and os.path.isdir(os.path.join(directory, name)))
+
+def default_device_id():
+    """This machine's host name, reduced to the characters a device id may hold."""
+    return re.sub(r"[^A-Za-z0-9_-]", "-", socket.gethostname()).strip("-_")[:64] or "monitor"
+
+def encode_log(log_data):
+    return json.dumps(log_data, separators=(",", ":"), sort_keys=True).encode()
+
+def encode_batch(device_id, sessions):
+    """Request body for a list of (log file name, log data) sessions."""
+    batch = {"device_id": device_id, "sessions": [{"log_file": log_file, "log": log} for log_file, log in sessions]}
+    return gzip.compress(json.dumps(batch, separators=(",", ":")).encode(), compresslevel=6)
+
+def decompress(body):
+    # Stop at the limit rather than inflating a hostile body in full
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, MAX_BATCH_BYTES + 1)
+    if len(data) > MAX_BATCH_BYTES or decompressor.unconsumed_tail:
+        raise ValueError(f"Batch is larger than {MAX_BATCH_BYTES} bytes uncompressed")
+    return data
+
+def decode_batch(body, content_encoding=None):
+    """Parse and check an upload; returns (device id, [(log file, log data)]).
+
+    The body is gzip-compressed JSON, either as Content-Encoding: gzip or bare;
+    anything malformed raises ValueError.
+    """
+    if content_encoding == "gzip" or body[:2] == b"\x1f\x8b":
+        try:
+            body = decompress(body)
+        except zlib.error as e:
+            raise ValueError(f"Body is not valid gzip: {e}")
+    elif len(body) > MAX_BATCH_BYTES:
+        raise ValueError(f"Batch is larger than {MAX_BATCH_BYTES} bytes")
+    try:
+        batch = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Body is not valid JSON: {e}")
+    if not isinstance(batch, dict) or not isinstance(batch.get("sessions"), list):
+        raise ValueError("Body must be an object with device_id and a sessions list")
+    device_id = batch.get("device_id")
+    device_directory("", device_id)
+    if len(batch["sessions"]) > MAX_BATCH_SESSIONS:
+        raise ValueError(f"At most {MAX_BATCH_SESSIONS} sessions per batch")
+
+    sessions = []
+    for session in batch["sessions"]:
+        log_file = session.get("log_file") if isinstance(session, dict) else None
+        log_data = session.get("log") if isinstance(session, dict) else None
+        if (not isinstance(log_file, str) or os.path.basename(log_file) != log_file
+                or not session_format.is_session_log(log_file) or not log_file.endswith(".json")):
+            raise ValueError(f"Bad log_file {log_file!r}; expected a sleep_log_*.json name")
+        if not isinstance(log_data, dict) or not isinstance(log_data.get("start_time"), str):
+            raise ValueError(f"{log_file} has no log with a start_time")
+        sessions.append((log_file, log_data))
+    return device_id, sessions
+
+class PendingUpload:
+    """One request's sessions, waiting for the writer to commit them."""
+
+    def __init__(self, device_id, sessions):
+        self.device_id = device_id
+        self.sessions = sessions
+        self.results = None  # log file -> "created", "updated" or "unchanged"
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """The per-session results; raises OSError if the batch could not be written."""
+        if not self.done.wait(timeout):
+            raise TimeoutError("Upload was not committed in time")
+        if self.error:
+            raise self.error
+        return self.results
+
+class IngestWriter(threading.Thread):
+    """Writes uploaded sessions into their device directories, batching concurrent uploads."""
+
+    def __init__(self, log_directory, max_batch_sessions=500, max_delay=0.02, on_commit=None):
+        super().__init__(daemon=True)
+        self.log_directory = log_directory
+        self.on_commit = on_commit  # Called with (device id, directory) after new sessions were stored
+        self.max_batch_sessions = max_batch_sessions
+        self.max_delay = max_delay  # Seconds to wait for more uploads to join a batch
+        self.queue = queue.Queue()
+        self.manifests = {}  # device id -> {log file: content hash}
+
+    def submit(self, device_id, sessions):
+        pending = PendingUpload(device_id, sessions)
+        self.queue.put(pending)
+        return pending
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            pending = self.queue.get()
+            if pending is None:
+                break
+            batch = [pending]
+            count = len(pending.sessions)
+            deadline = time.monotonic() + self.max_delay
+            stopping = False
+            while count < self.max_batch_sessions:
+                try:
+                    pending = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+                count += len(pending.sessions)
+            self.commit(batch)
+            if stopping:
+                break
+
+    def manifest(self, device_id, directory):
+        if device_id not in self.manifests:
+            path = os.path.join(directory, MANIFEST_FILE)
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    self.manifests[device_id] = json.load(f)
+            else:
+                self.manifests[device_id] = {}
+        return self.manifests[device_id]
+
+    def commit(self, batch):
+        by_device = {}
+        for pending in batch:
+            by_device.setdefault(pending.device_id, []).append(pending)
+        for device_id, uploads in by_device.items():
+            try:
+                written = self.commit_device(device_id, uploads)
+            except OSError as e:
+                written = False
+                print(f"Error writing uploads from {device_id}: {e}")
+                # Forget the cached manifest; it may list files that never made it to disk
+                self.manifests.pop(device_id, None)
+                for pending in uploads:
+                    pending.error = e
+            # Derived data is brought up to date before the uploader hears back, so a
+            # dashboard request after a successful upload already sees the new sessions
+            if written and self.on_commit:
+                self.on_commit(device_id, device_directory(self.log_directory, device_id))
+            for pending in uploads:
+                pending.done.set()
+
+    def commit_device(self, device_id, uploads):
+        directory = device_directory(self.log_directory, device_id)
+        os.makedirs(directory, exist_ok=True)
+        manifest = self.manifest(device_id, directory)
+        written = False
+        for pending in uploads:
+            pending.results = {}
+            for log_file, log_data in pending.sessions:
+                content = encode_log(log_data)
+                digest = hashlib.sha256(content).hexdigest()
+                path = os.path.join(directory, log_file)
+                if manifest.get(log_file) == digest and os.path.exists(path):
+                    pending.results[log_file] = "unchanged"
+                    continue
+                pending.results[log_file] = "updated" if log_file in manifest else "created"
+                write_file_atomically(path, content, sync_directory=False)
+                manifest[log_file] = digest
+                written = True
+        if written:
+            # The logs are synced before the manifest that vouches for them is replaced,
+            # and this one directory sync makes all of the renames durable
+            sync_directory_entries(directory)
+            write_json_atomically(os.path.join(directory, MANIFEST_FILE), manifest)
+        return written
+
+class SessionUploader(threading.Thread):
+    """Sends this monitor's finished sessions to the hub's /api/ingest.
+
+    Every upload goes through the log directory, not just the newest session:
+    whatever the hub has not accepted yet, for example while it was down, is
+    sent with the next one. Accepted log files are remembered in uploaded.json.
+    """
+
+    def __init__(self, hub_url, device_id, token, log_directory, timeout=30, batch_sessions=20):
+        super().__init__(daemon=True)
+        device_directory("", device_id)
+        self.url = hub_url.rstrip("/") + "/api/ingest"
+        self.device_id = device_id
+        self.token = token
+        self.log_directory = log_directory
+        self.timeout = timeout
+        self.batch_sessions = batch_sessions
+        self.requested = threading.Event()
+        self.running = True
+
+    def request_upload(self):
+        self.requested.set()
+
+    def stop(self):
+        self.running = False
+        self.requested.set()
+        self.join()
+
+    def run(self):
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+            if not self.running:
+                break
+            self.upload_pending()
+
+    def state_path(self):
+        return os.path.join(self.log_directory, UPLOAD_STATE_FILE)
+
+    def load_state(self):
+        if not os.path.exists(self.state_path()):
+            return set()
+        with open(self.state_path(), 'r') as f:
+            return set(json.load(f))
+
+    def batches(self, pending):
+        """Batches of (local log file, upload name, log data), limited in count and size."""
+        batch, size = [], 0
+        for log_file in pending:
+            try:
+                log_data = session_format.read_log(os.path.join(self.log_directory, log_file))
+            except (ValueError, OSError) as e:
+                print(f"Not uploading {log_file}: {e}")
+                continue
+            length = len(encode_log(log_data))
+            if batch and (len(batch) == self.batch_sessions or size + length > MAX_UPLOAD_BYTES):
+                yield batch
+                batch, size = [], 0
+            # The hub stores everything as JSON, so binary logs are sent under their .json name
+            batch.append((log_file, os.path.splitext(log_file)[0] + ".json", log_data))
+            size += length
+        if batch:
+            yield batch
+
+    def post(self, body):
+        request = urllib.request.Request(self.url, data=body, method="POST", headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip",
+            "Authorization": f"Bearer {self.token}"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def upload_pending(self):
+        """Upload every session the hub has not accepted yet; returns how many were accepted."""
+        uploaded = self.load_state()
+        pending = sorted(log_file for log_file in os.listdir(self.log_directory)
+                         if session_format.is_session_log(log_file) and log_file not in uploaded)
+        accepted = 0
+        for batch in self.batches(pending):
+            body = encode_batch(self.device_id, [(name, log_data) for _, name, log_data in batch])
+            try:
+                self.post(body)
+            except urllib.error.HTTPError as e:
+                # Refused outright (bad token, too large); the rest may still go through
+                print(f"Hub refused {len(batch)} session(s): HTTP {e.code} {e.reason}")
+                if e.code in (401, 403):
+                    break
+                continue
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print(f"Hub not reachable, will retry after the next session: {e}")
+                break
+            uploaded.update(log_file for log_file, _, _ in batch)
+            write_json_atomically(self.state_path(), sorted(uploaded))
+            accepted += len(batch)
+        if accepted:
+            print(f"Uploaded {accepted} session(s) to {self.url} as {self.device_id}.")
+        return accepted
@@ -0,0 +1,621 @@
+# sleep_analysis.py
+"""Session analysis core shared by the monitor, the dashboard and the offline tools.
+
+Only numpy and the standard library are needed, so this imports quickly and works
+on machines without the camera, GPIO or I2C libraries.
+"""
+import itertools
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import session_format
+
+# One record per processed camera frame: 12 bytes, readable in place with numpy.memmap
+INTENSITY_DTYPE = np.dtype([("timestamp", "<f8"), ("intensity", "<f4")])
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_us(time):
+    return (time - EPOCH) // MICROSECOND
+
+def from_us(us):
+    return EPOCH + timedelta(microseconds=us)
+
+class MotionIntensityRecorder:
+    """Appends (timestamp, intensity) records to a fixed-dtype binary file."""
+
+    def __init__(self, path, flush_every=64):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.buffer = np.empty(flush_every, dtype=INTENSITY_DTYPE)
+        self.count = 0
+
+    def append(self, timestamp, intensity):
+        self.buffer[self.count] = (timestamp, intensity)
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def extend(self, timestamps, intensities):
+        self.flush()
+        records = np.empty(len(timestamps), dtype=INTENSITY_DTYPE)
+        records["timestamp"] = timestamps
+        records["intensity"] = intensities
+        self.file.write(records.tobytes())
+
+    def flush(self):
+        if self.count:
+            self.file.write(self.buffer[:self.count].tobytes())
+            self.count = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+SPILL_PREFIX = ".sleep_spill_"
+
+class EventSpill:
+    """Events moved out of memory during a long session.
+
+    Every spill adds one segment file per kind of event, holding int64 rows: (start,
+    end) microseconds since the epoch for motion events, single times for sound
+    peaks and so on. The files start with a dot, so they never show up as session
+    logs.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.segments = {}  # kind -> segment paths
+        self.columns = {}  # kind -> values per row
+
+    def write(self, kind, values):
+        values = np.asarray(values, dtype="<i8")
+        paths = self.segments.setdefault(kind, [])
+        path = os.path.join(self.directory, f".{self.name}_{kind}_{len(paths):04d}.spill")
+        values.tofile(path)
+        paths.append(path)
+        self.columns[kind] = values.shape[1] if values.ndim == 2 else 1
+
+    def read(self, kind):
+        for path in self.segments.get(kind, []):
+            values = np.fromfile(path, dtype="<i8")
+            yield values.reshape(-1, self.columns[kind]) if self.columns[kind] > 1 else values
+
+    def remove(self):
+        for paths in self.segments.values():
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            paths.clear()
+
+def remove_stale_spills(directory):
+    """Delete spill segments left behind by a session that never finished, e.g. after a crash."""
+    for filename in os.listdir(directory):
+        if filename.startswith(SPILL_PREFIX) and filename.endswith(".spill"):
+            os.remove(os.path.join(directory, filename))
+
+class Replayable:
+    """An iterable that starts over every time it is iterated, unlike a generator.
+
+    Session logs hold their event lists as these, so the events can be written
+    from the spill segments more than once (see session_format.encode_chunks).
+    """
+
+    def __init__(self, make_iterator):
+        self.make_iterator = make_iterator
+
+    def __iter__(self):
+        return self.make_iterator()
+
+# Sound peaks less than this apart belong to one snoring episode, which takes at least
+# MIN_SNORE_PEAKS peaks; a single noise is not snoring
+SNORE_GAP_SECONDS = 30
+MIN_SNORE_PEAKS = 3
+# Motion events starting less than this after the previous one ended form one restless period
+RESTLESS_GAP_SECONDS = 300
+MIN_RESTLESS_EVENTS = 2
+
+class EpisodeClusterer:
+    """Groups a time-ordered stream of events into episodes, one event at a time.
+
+    An event that starts less than `gap` after the episode so far ended continues it.
+    Times are integer microseconds, so the result matches cluster_episodes() exactly.
+    Only a few numbers are kept, however long the stream.
+    """
+
+    def __init__(self, gap_seconds, min_events=1):
+        self.gap = gap_seconds * 1000000
+        self.min_events = min_events
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.longest = 0
+        self.start = None
+        self.end = None
+        self.events = 0
+
+    def add(self, start, end=None):
+        end = start if end is None else end
+        if self.start is not None and start - self.end < self.gap:
+            self.end = max(self.end, end)
+            self.events += 1
+            return
+        self.close()
+        self.start, self.end, self.events = start, end, 1
+
+    def close(self):
+        if self.start is not None and self.events >= self.min_events:
+            self.count += 1
+            self.total += self.end - self.start
+            self.longest = max(self.longest, self.end - self.start)
+        self.start = None
+
+    def summary(self):
+        """(episodes, total microseconds, longest microseconds), counting the episode still open."""
+        count, total, longest = self.count, self.total, self.longest
+        if self.start is not None and self.events >= self.min_events:
+            count, total, longest = count + 1, total + self.end - self.start, max(longest, self.end - self.start)
+        return count, total, longest
+
+def cluster_episodes(starts, ends, gap_seconds, min_events=1):
+    """EpisodeClusterer over whole sorted int64 microsecond arrays at once, in linear time."""
+    if len(starts) == 0:
+        return 0, 0, 0
+    # For point events the running end is the times themselves and the gaps a plain np.diff
+    running_end = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] - running_end[:-1] >= gap_seconds * 1000000) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.append(breaks, len(starts)) - 1
+    kept = last - first + 1 >= min_events
+    durations = running_end[last[kept]] - starts[first[kept]]
+    return int(kept.sum()), int(durations.sum()), int(durations.max(initial=0))
+
+def episode_fields(snoring, restless):
+    """Report fields for (episodes, total, longest) summaries of snoring and restlessness."""
+    return {
+        "snoring_episodes": snoring[0],
+        "snoring_duration": f"{snoring[1] / 60e6:.1f} minutes",
+        "longest_snoring_episode": f"{snoring[2] / 60e6:.1f} minutes",
+        "restless_periods": restless[0],
+        "restless_duration": f"{restless[1] / 60e6:.1f} minutes",
+        "longest_restless_period": f"{restless[2] / 60e6:.1f} minutes"
+    }
+
+def episodes_from_log(log_data):
+    """episode_fields() for a finished log in the JSON layout, for logs saved before they were reported."""
+    def us(times):
+        return np.array(times, dtype="datetime64[us]").astype(np.int64)
+
+    peaks = np.sort(us(log_data.get("sound_peaks", [])))
+    events = sorted(log_data.get("motion_events", []), key=lambda event: event["start"])
+    starts = us([event["start"] for event in events])
+    ends = us([event["end"] for event in events])
+    return episode_fields(cluster_episodes(peaks, peaks, SNORE_GAP_SECONDS, MIN_SNORE_PEAKS),
+                          cluster_episodes(starts, ends, RESTLESS_GAP_SECONDS, MIN_RESTLESS_EVENTS))
+
+class SleepQualityAnalyzer:
+    def __init__(self, log_directory="sleep_logs", log_format="json", max_events_in_memory=50000):
+        # Only the newest events are kept in these lists; older ones are in self.spill
+        self.motion_events = []
+        self.sound_peaks = []
+        self.max_events_in_memory = max_events_in_memory
+        self.spill = None
+        # Running totals over the whole session, spilled events included
+        self.motion_event_count = 0
+        self.total_motion_seconds = 0
+        self.sound_peak_count = 0
+        # Episodes are found as the events arrive, so spilled events never need reading back
+        self.snore_episodes = EpisodeClusterer(SNORE_GAP_SECONDS, MIN_SNORE_PEAKS)
+        self.restless_periods = EpisodeClusterer(RESTLESS_GAP_SECONDS, MIN_RESTLESS_EVENTS)
+        self.zone_motion_events = {}  # Newest events per zone, like motion_events
+        self.zone_motion_counts = {}
+        self.zone_spill_kinds = {}  # zone -> its kind of spill segment
+        self.profiles = {}
+        self.frame_rate_changes = []  # Newest changes only, like motion_events
+        self.startup = None
+        self.monitoring_start_time = None
+        self.monitoring_end_time = None
+        self.intensity_recorder = None
+        self.lock = threading.Lock()
+        self.log_directory = os.path.abspath(log_directory)
+        self.log_format = log_format  # "json", or "binary" for the compact .slog format (see session_format)
+        
+        # Ensure the log directory exists
+        os.makedirs(self.log_directory, exist_ok=True)
+        print(f"Log directory set to: {self.log_directory}")
+
+    def start_monitoring(self, start_time=None):
+        with self.lock:
+            self.monitoring_start_time = start_time or datetime.now()
+            self.monitoring_end_time = None
+            self.motion_events.clear()
+            self.sound_peaks.clear()
+            self.motion_event_count = 0
+            self.total_motion_seconds = 0
+            self.sound_peak_count = 0
+            self.snore_episodes.reset()
+            self.restless_periods.reset()
+            self.set_zones([])
+            self.profiles = {}
+            self.frame_rate_changes.clear()
+            self.startup = None
+
+            # The per-frame intensity series lives beside the session log
+            if self.intensity_recorder:
+                self.intensity_recorder.close()
+            start_time_str = self.monitoring_start_time.strftime("%Y%m%d_%H%M%S")
+            if self.spill:
+                self.spill.remove()
+            # Segments of a session that crashed would otherwise stay forever
+            remove_stale_spills(self.log_directory)
+            self.spill = EventSpill(self.log_directory, f"{SPILL_PREFIX[1:]}{start_time_str}")
+            intensity_path = os.path.join(self.log_directory, f"sleep_intensity_{start_time_str}.bin")
+            self.intensity_recorder = MotionIntensityRecorder(intensity_path)
+            print("Sleep quality monitoring started.")
+
+    def mark_live(self, live_time, startup):
+        """Start the session clock at the moment every sensor was delivering samples.
+
+        `startup` maps each component to the seconds it took to come up after the
+        session was requested; it is kept in the log.
+        """
+        with self.lock:
+            self.monitoring_start_time = live_time
+            self.startup = startup
+            print(f"Sensors live after {max(startup.values()):.2f} seconds.")
+
+    def stop_monitoring(self, end_time=None):
+        with self.lock:
+            self.monitoring_end_time = end_time or datetime.now()
+            if self.intensity_recorder:
+                self.intensity_recorder.flush()
+            print("Sleep quality monitoring stopped.")
+
+    def log_motion_event(self, start_time, end_time):
+        with self.lock:
+            duration = (end_time - start_time).total_seconds()
+            self.motion_events.append({"start": start_time, "end": end_time, "duration": duration})
+            self.motion_event_count += 1
+            self.total_motion_seconds += duration
+            self.restless_periods.add(to_us(start_time), to_us(end_time))
+            print(f"Motion event logged from {start_time} to {end_time}, duration: {duration:.2f} seconds")
+            self.spill_if_needed()
+
+    def set_motion_zones(self, zones):
+        with self.lock:
+            self.set_zones(zones)
+
+    def set_zones(self, zones):
+        # Called with the lock held
+        self.zone_motion_events = {}
+        self.zone_motion_counts = {}
+        self.zone_spill_kinds = {}
+        for zone in zones:
+            self.add_zone(zone)
+
+    def add_zone(self, zone):
+        # Zone names come from the ROI config, so spill files are named by number instead
+        self.zone_motion_events[zone] = []
+        self.zone_motion_counts[zone] = 0
+        self.zone_spill_kinds[zone] = f"zone{len(self.zone_spill_kinds)}"
+
+    def log_zone_motion_event(self, zone, start_time, end_time):
+        with self.lock:
+            duration = (end_time - start_time).total_seconds()
+            if zone not in self.zone_motion_events:
+                self.add_zone(zone)
+            self.zone_motion_events[zone].append({"start": start_time, "end": end_time, "duration": duration})
+            self.zone_motion_counts[zone] += 1
+            print(f"Motion in {zone} zone logged from {start_time} to {end_time}, duration: {duration:.2f} seconds")
+            self.spill_if_needed()
+
+    def log_frame_rate(self, timestamp, fps):
+        with self.lock:
+            # Always a float, so spilled changes read back the same
+            self.frame_rate_changes.append({"time": timestamp, "fps": float(fps)})
+            print(f"Camera sampling rate set to {fps:g} fps")
+            self.spill_if_needed()
+
+    def record_profile(self, component, summary):
+        with self.lock:
+            self.profiles[component] = summary
+
+    def log_sound_peak(self, timestamp):
+        with self.lock:
+            self.sound_peaks.append(timestamp)
+            self.sound_peak_count += 1
+            self.snore_episodes.add(to_us(timestamp))
+            print(f"Sound peak logged at {timestamp}")
+            self.spill_if_needed()
+
+    def spill_if_needed(self):
+        # Called with the lock held
+        in_memory = (len(self.motion_events) + len(self.sound_peaks) + len(self.frame_rate_changes)
+                     + sum(len(events) for events in self.zone_motion_events.values()))
+        if in_memory <= self.max_events_in_memory or not self.spill:
+            return
+        if self.motion_events:
+            self.spill.write("motion", [(to_us(event["start"]), to_us(event["end"])) for event in self.motion_events])
+            self.motion_events.clear()
+        if self.sound_peaks:
+            self.spill.write("sound", [to_us(peak) for peak in self.sound_peaks])
+            self.sound_peaks.clear()
+        for zone, events in self.zone_motion_events.items():
+            if events:
+                self.spill.write(self.zone_spill_kinds[zone],
+                                 [(to_us(event["start"]), to_us(event["end"])) for event in events])
+                events.clear()
+        if self.frame_rate_changes:
+            # The rate is kept as the bits of its float64, so it reads back exactly
+            fps = np.array([change["fps"] for change in self.frame_rate_changes], dtype=np.float64).view(np.int64)
+            self.spill.write("frame_rate", np.column_stack([[to_us(change["time"]) for change in self.frame_rate_changes], fps]))
+            self.frame_rate_changes.clear()
+        print(f"Moved events to disk; {self.motion_event_count} motion events and {self.sound_peak_count} sound peaks so far.")
+
+    def log_motion_intensity(self, timestamp, intensity):
+        # Called for every processed frame, so nothing is printed here
+        with self.lock:
+            if self.intensity_recorder and not self.monitoring_end_time:
+                self.intensity_recorder.append(timestamp, intensity)
+
+    def calculate_sleep_score(self):
+        with self.lock:
+            if not self.monitoring_start_time or not self.monitoring_end_time:
+                return None
+
+            # Calculate total monitoring duration in hours
+            total_duration = (self.monitoring_end_time - self.monitoring_start_time).total_seconds() / 3600  # in hours
+
+            if total_duration == 0:
+                return 50  # Default to 50 if the total duration is too short to evaluate
+
+            # 1. Calculate motion score
+            total_motion_duration = self.total_motion_seconds / 3600  # in hours
+            motion_percentage = (total_motion_duration / total_duration) * 100
+            motion_penalty = min(motion_percentage * 1.5, 100)  # Adjusted to 1.5 points deduction per percentage of motion
+            motion_score = max(100 - motion_penalty, 10)  # Ensure a minimum motion score of 10
+
+            # 2. Calculate sound score
+            sound_frequency = self.sound_peak_count / total_duration  # Sound peaks per hour
+            sound_penalty = min(sound_frequency * 5, 100)  # Adjusted to 5 points deduction per sound peak per hour
+            sound_score = max(100 - sound_penalty, 10)  # Ensure a minimum sound score of 10
+
+            # 3. Calculate overall sleep score
+            # Adjust weightings dynamically if thereâ€™s too much movement or noise
+            if motion_percentage > 50:
+                motion_weight = 0.7  # Increase weight of motion if movement is very high
+                sound_weight = 0.3
+            elif sound_frequency > 20:
+                motion_weight = 0.4  # Increase weight of sound if noise is very high
+                sound_weight = 0.6
+            else:
+                motion_weight = 0.6  # Default weightings
+                sound_weight = 0.4
+
+            sleep_score = (motion_score * motion_weight) + (sound_score * sound_weight)
+
+            # Ensure a minimum sleep score to avoid 0
+            sleep_score = min(max(sleep_score, 15), 100)  # Minimum sleep score is 15
+
+            return round(sleep_score, 2)
+
+           
+
+    def generate_sleep_report(self):
+        sleep_score = self.calculate_sleep_score()
+        if sleep_score is None:
+            return "No monitoring data available."
+
+        total_duration = (self.monitoring_end_time - self.monitoring_start_time).total_seconds() / 3600  # in hours
+        total_motion_duration = self.total_motion_seconds / 3600  # in hours
+        motion_percentage = (total_motion_duration / total_duration) * 100 if total_duration > 0 else 0
+
+        report = {
+            "sleep_score": sleep_score,
+            "monitoring_duration": f"{total_duration:.2f} hours",
+            "motion_events": self.motion_event_count,
+            "total_motion_duration": f"{total_motion_duration:.2f} hours",
+            "motion_percentage": f"{motion_percentage:.2f}%",
+            "sound_peaks": self.sound_peak_count,
+            "sound_peaks_per_hour": round(self.sound_peak_count / total_duration, 2) if total_duration > 0 else 0
+        }
+        with self.lock:
+            report.update(episode_fields(self.snore_episodes.summary(), self.restless_periods.summary()))
+        if self.zone_motion_counts:
+            report["zone_motion_events"] = dict(self.zone_motion_counts)
+
+        return report
+
+    def finalize_session(self):
+        """Write the session log, sleep report included, in one atomic step.
+
+        The log is written to a temporary file, synced and renamed over the final
+        name, so readers of the log directory only ever see complete logs. Events
+        are streamed into it from the spill segments and memory, so a long
+        session never has to be held in memory as a whole.
+        Returns the log path and the report.
+        """
+        if not self.monitoring_end_time:
+            self.stop_monitoring()
+        report = self.generate_sleep_report()
+        with self.lock:
+            filepath, log_data = self.build_log()
+        log_data["sleep_report"] = report
+        if self.log_format == "binary":
+            del log_data["motion_events"], log_data["sound_peaks"]
+            write_chunks_atomically(filepath, session_format.encode_chunks(
+                log_data, self.motion_event_count, self.sound_peak_count, self.motion_segments, self.peak_segments,
+                dump_header=json_chunks))
+        else:
+            write_chunks_atomically(filepath, json_chunks(log_data))
+        if self.spill:
+            self.spill.remove()
+        return filepath, report
+
+    def iter_motion_events(self, kind="motion", events=None):
+        """Every motion event of the session (or of one zone) in the log layout, spilled ones first."""
+        for segment in self.spill.read(kind) if self.spill else []:
+            for start, end in segment.tolist():
+                yield {"start": from_us(start).isoformat(), "end": from_us(end).isoformat(),
+                       "duration": timedelta(microseconds=end - start).total_seconds()}
+        for event in self.motion_events if events is None else events:
+            yield {"start": event["start"].isoformat(), "end": event["end"].isoformat(), "duration": event["duration"]}
+
+    def iter_frame_rate_changes(self):
+        for segment in self.spill.read("frame_rate") if self.spill else []:
+            fps = np.ascontiguousarray(segment[:, 1]).view(np.float64)
+            for time, rate in zip(segment[:, 0].tolist(), fps.tolist()):
+                yield {"time": from_us(time).isoformat(), "fps": rate}
+        for change in self.frame_rate_changes:
+            yield {"time": change["time"].isoformat(), "fps": change["fps"]}
+
+    def iter_sound_peaks(self):
+        for segment in self.spill.read("sound") if self.spill else []:
+            for peak in segment.tolist():
+                yield from_us(peak).isoformat()
+        for peak in self.sound_peaks:
+            yield peak.isoformat()
+
+    def motion_segments(self):
+        """(starts, ends) datetime64[us] arrays of the session's motion events, one spill segment at a time."""
+        segments = self.spill.read("motion") if self.spill else []
+        in_memory = np.array([(to_us(event["start"]), to_us(event["end"])) for event in self.motion_events],
+                             dtype=np.int64).reshape(-1, 2)
+        for segment in itertools.chain(segments, [in_memory]):
+            segment = segment.astype("datetime64[us]")
+            yield segment[:, 0], segment[:, 1]
+
+    def peak_segments(self):
+        """datetime64[us] arrays of the session's sound peaks, one spill segment at a time."""
+        segments = self.spill.read("sound") if self.spill else []
+        in_memory = np.array([to_us(peak) for peak in self.sound_peaks], dtype=np.int64)
+        for segment in itertools.chain(segments, [in_memory]):
+            yield segment.astype("datetime64[us]")
+
+    def build_log(self):
+        # Generate filename based on start and end time
+        start_time_str = self.monitoring_start_time.strftime("%Y%m%d_%H%M%S")
+        end_time_str = self.monitoring_end_time.strftime("%Y%m%d_%H%M%S")
+        extension = "slog" if self.log_format == "binary" else "json"
+        filename = f"sleep_log_{start_time_str}_to_{end_time_str}.{extension}"
+        filepath = os.path.join(self.log_directory, filename)
+
+        # The events are read from the spill and memory only as the log is written (see json_chunks)
+        log_data = {
+            "start_time": self.monitoring_start_time.isoformat(),
+            "end_time": self.monitoring_end_time.isoformat(),
+            "motion_events": Replayable(self.iter_motion_events),
+            "sound_peaks": Replayable(self.iter_sound_peaks)
+        }
+        if self.zone_motion_counts:
+            log_data["zone_motion_events"] = {
+                zone: Replayable(lambda zone=zone: self.iter_motion_events(self.zone_spill_kinds[zone],
+                                                                           self.zone_motion_events[zone]))
+                for zone in self.zone_motion_counts
+            }
+        if self.frame_rate_changes or (self.spill and self.spill.segments.get("frame_rate")):
+            log_data["frame_rate_changes"] = Replayable(self.iter_frame_rate_changes)
+        if self.startup:
+            log_data["startup_seconds"] = self.startup
+        if self.profiles:
+            log_data["profiling"] = self.profiles
+        if self.intensity_recorder:
+            self.intensity_recorder.close()
+            log_data["motion_intensity_file"] = os.path.basename(self.intensity_recorder.path)
+            self.intensity_recorder = None
+        return filepath, log_data
+
+def write_json_atomically(filepath, data):
+    """Write data as compact JSON so that filepath is either the old file or the complete new one."""
+    write_file_atomically(filepath, json.dumps(data, separators=(",", ":")).encode())
+
+def json_chunks(data, batch=1000):
+    """The compact JSON of a dict, as json.dumps would write it, in chunks of bytes.
+
+    Values that are iterators or Replayable are written as arrays, `batch` items at
+    a time, so they are never held in memory as a whole; nested dicts may hold them
+    too.
+    """
+    if not data:
+        yield b"{}"
+        return
+    separator = b"{"
+    for key, value in data.items():
+        yield separator + json.dumps(key).encode() + b":"
+        separator = b","
+        if isinstance(value, dict):
+            yield from json_chunks(value, batch)
+            continue
+        if not (hasattr(value, "__next__") or isinstance(value, Replayable)):
+            yield json.dumps(value, separators=(",", ":")).encode()
+            continue
+        value = iter(value)
+        prefix = b"["
+        while True:
+            items = list(itertools.islice(value, batch))
+            if not items:
+                break
+            yield prefix + ",".join(json.dumps(item, separators=(",", ":")) for item in items).encode()
+            prefix = b","
+        yield b"[]" if prefix == b"[" else b"]"
+    yield b"}"
+
+def write_file_atomically(filepath, content, sync_directory=True):
+    """Write content so that filepath is either the old file or the complete new one.
+
+    With sync_directory=False the rename is not yet durable; a batch of writes can be
+    made durable together with one sync_directory_entries() call afterwards.
+    """
+    write_chunks_atomically(filepath, [content], sync_directory)
+
+def write_chunks_atomically(filepath, chunks, sync_directory=True):
+    """write_file_atomically for content given as an iterable of byte strings."""
+    directory = os.path.dirname(filepath)
+    # The leading dot keeps the partial file out of the sleep_log_* listing
+    temp_path = os.path.join(directory, f".{os.path.basename(filepath)}.tmp")
+    with open(temp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, filepath)
+    if sync_directory:
+        # Persist the rename itself
+        sync_directory_entries(directory)
+
+def sync_directory_entries(directory):
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+class MotionEventTracker:
+    """Turns per-frame motion decisions into (start, end) motion events."""
+
+    def __init__(self, cooldown=3):
+        self.cooldown = cooldown  # Time in seconds to wait before considering a new motion event
+        self.motion_ongoing = False
+        self.motion_start_time = None
+
+    def update(self, motion_detected, timestamp):
+        if motion_detected and not self.motion_ongoing:
+            # Start of a new motion event
+            self.motion_ongoing = True
+            self.motion_start_time = timestamp
+        elif not motion_detected and self.motion_ongoing:
+            # Potential end of motion event
+            if timestamp - self.motion_start_time > self.cooldown:
+                # Motion has stopped for longer than the cooldown period
+                self.motion_ongoing = False
+                return self.motion_start_time, timestamp
+        return None
@@ -1,15 +1,16 @@
 import json
 from datetime import datetime
-import random
 import threading
-from gpiozero import LED, Button
 import time
-import cv2
-from picamera2 import Picamera2
-import smbus2
 import os
-import time
-import smbus2
+
+from lazy_module import LazyModule
+
+# Imported when the hardware is first used, so the module itself loads quickly and without them
+cv2 = LazyModule("cv2")
+gpiozero = LazyModule("gpiozero")
+picamera2 = LazyModule("picamera2")
+smbus2 = LazyModule("smbus2")
 
 class LCD1602(object):
     # commands
@@ -272,7 +273,7 @@ class SoundMonitor(threading.Thread):
         self.window_start_time = time.time()
 
     def run(self):
-        self.sound_sensor = Button(self.sound_sensor_pin, pull_up=False)
+        self.sound_sensor = gpiozero.Button(self.sound_sensor_pin, pull_up=False)
         self.running = True
         print("Sound monitoring started.")
         while self.running:
@@ -316,7 +317,7 @@ class SoundMonitor(threading.Thread):
 class InfraredCameraMonitor(threading.Thread):
     def __init__(self, resolution=(640, 480), framerate=30, analyzer=None):
         super().__init__()
-        self.camera = Picamera2()
+        self.camera = picamera2.Picamera2()
         config = self.camera.create_still_configuration(main={"size": resolution, "format": "RGB888"})
         self.camera.configure(config)
         self.camera.set_controls({"FrameDurationLimits": (int(1/framerate*1000000), int(1/framerate*1000000))})
@@ -503,7 +504,7 @@ def main():
     bus = smbus2.SMBus(1)
     lcd = LCD1602(bus, lines=2, dotsize=0)
     analyzer = SleepQualityAnalyzer(log_directory=log_directory)
-    control_button = Button(25)
+    control_button = gpiozero.Button(25)
 
     lcd_interface = LCDButtonInterface(lcd, control_button, analyzer)
 